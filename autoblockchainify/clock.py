@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# The time used for scheduling commits, timestamps and mail
+#
+# All scheduling decisions ask this module for the time and wait through it,
+# so `autoblockchainify.simulation` can replace the wall clock by a virtual
+# one (`install()`). Log messages and resource pacing use the real time.
+
+import time as _time
+from datetime import datetime, timezone
+
+
+class Clock:
+    """The wall clock"""
+
+    def time(self):
+        return _time.time()
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """`event.wait(timeout)`"""
+        return event.wait(timeout)
+
+    def touch(self, path):
+        """Set the modification time of `path` to now; as the file system
+        uses the wall clock, only needed for a virtual clock"""
+        pass
+
+
+current = Clock()
+
+
+def install(clock):
+    global current
+    current = clock
+
+
+def time():
+    return current.time()
+
+
+def sleep(seconds):
+    current.sleep(seconds)
+
+
+def wait(event, timeout):
+    return current.wait(event, timeout)
+
+
+def touch(path):
+    current.touch(path)
+
+
+def now():
+    """Current time as a timezone-aware UTC `datetime`"""
+    return datetime.fromtimestamp(current.time(), timezone.utc)
+
+
+def utcnow():
+    """Current time as a naive UTC `datetime`, like `datetime.utcnow()`"""
+    return now().replace(tzinfo=None)
+
+
+def gmtime():
+    return _time.gmtime(current.time())
+
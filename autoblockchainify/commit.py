@@ -20,48 +20,111 @@
 
 # Committing to git and obtaining timestamps
 
-from datetime import datetime, timezone
+from datetime import datetime
 import signale
 from pathlib import Path
+from stat import S_ISDIR
 import subprocess
 import sys
 import threading
 import time
 import traceback
 
-import pygit2 as git
-
+import autoblockchainify.clock
 import autoblockchainify.config
+import autoblockchainify.index
+import autoblockchainify.journal
+import autoblockchainify.log
 import autoblockchainify.mail
+import autoblockchainify.metrics
+import autoblockchainify.push
+import autoblockchainify.repository
+import autoblockchainify.seal
+import autoblockchainify.shard
+import autoblockchainify.throttle
 
-logging = signale.Signale({"scope": "commit"})
+logging = autoblockchainify.log.Logger("commit")
+# Set to stop scheduling further commit cycles
+shutdown = threading.Event()
+# Set to reload the configuration at the next cycle
+reload_requested = threading.Event()
+# Only one cycle may work on the repository (and the journal) at a time
+serialize_commit = threading.Lock()
+# Per Zeitgitter server: (commit ID, clock.time()) of last successful
+# timestamp, across cycles
+timestamped = {}
+# [(status, path)] found by the last `scan()`, to be staged by the next commit
+changeset = []
 
 
 def push_upstream(repo, to, branches):
-    logging.pending("Pushing to %s" % (['git', 'push', to] + branches))
-    ret = subprocess.run(['git', 'push', to] + branches,
-                         cwd=repo)
-    if ret.returncode != 0:
-        logging.error("'git push %s %s' failed" % (to, ' '.join(branches)))
+    success = autoblockchainify.push.push(repo, to, branches)
+    if autoblockchainify.config.arg.shard_subdirectories:
+        # Make the gitlinks resolvable there
+        success = autoblockchainify.shard.push(repo, to) and success
+    return success
 
 
 def cross_timestamp(repo, options, server):
     ret = subprocess.run(['git', 'timestamp'] + options, cwd=repo)
     if ret.returncode != 0:
-        logging.error("git timestamp %s failed" % (' '.join(options)))
+        logging.error("git timestamp %s failed", ' '.join(options))
+        return False
     else:
-        logging.success("Timestamped against %s" % server)
+        logging.success("Timestamped against %s", server)
+        return True
+
+
+def timestamp_deferred(target, head):
+    """Whether timestamping `head` with `target` (a `--zeitgitter-servers`
+    entry) can be skipped (`'covered'`) or postponed to a later cycle
+    (`'deferred'`), as the last timestamp by `target` is younger than
+    `--timestamp-window`. All commits made until the window expires are
+    then covered by a single timestamp."""
+    (last_commit, last_time) = timestamped.get(target, (None, 0))
+    if last_commit == head:
+        return 'covered'
+    window = autoblockchainify.config.arg.timestamp_window.total_seconds()
+    if last_time + window > autoblockchainify.clock.time():
+        return 'deferred'
+    return None
+
+
+def scan(repo):
+    """Find the uncommitted changes with `git status`, as list of
+    `(status, path)`. Also remembered as `changeset`, for staging."""
+    global changeset
+    start = time.monotonic()
+    cmd = ['git', 'status', '-z', '--no-renames']
+    if autoblockchainify.config.arg.shard_subdirectories:
+        # Uncommitted changes inside shards are for the next cycle
+        cmd.append('--ignore-submodules=dirty')
+    if autoblockchainify.throttle.limited():
+        # Individual files, for pacing
+        cmd.append('--untracked-files=all')
+    ret = autoblockchainify.throttle.run(cmd, cwd=repo, capture_output=True,
+                                         check=True)
+    changeset = [(entry[:2].decode(),
+                  entry[3:].decode('UTF-8', 'surrogateescape'))
+                 for entry in ret.stdout.split(b'\0') if entry]
+    autoblockchainify.metrics.update({
+        'scan.seconds': time.monotonic() - start,
+        'scan.changes': len(changeset),
+    })
+    return changeset
 
 
 def has_user_changes(repo):
     """Check whether there are uncommitted changes, i.e., whether
     `git status -z` has any output. A modification of only `pgp-timestamp.sig`
-    is ignored, as it is neither necessary nor desirable to trigger on it:
+    (or the signature files of further mail accounts) is ignored, as it is
+    neither necessary nor desirable to trigger on it:
     (a) our own timestamp is not really needed on it and
     (b) it would cause an unnecessary second timestamp per idle force period."""
-    ret = subprocess.run(['git', 'status', '-z'],
-                         cwd=repo, capture_output=True, check=True)
-    return len(ret.stdout) > 0 and ret.stdout != b' M pgp-timestamp.sig\0'
+    changes = scan(repo)
+    sigfiles = autoblockchainify.mail.sigfile_names() or ['pgp-timestamp.sig']
+    return any(status != ' M' or path not in sigfiles
+               for (status, path) in changes)
 
 
 def pending_merge(repo):
@@ -69,34 +132,269 @@ def pending_merge(repo):
     return Path(repo, '.git', 'MERGE_HEAD').is_file()
 
 
+def file_sizes(repo, changes):
+    """Sizes of the files in `changes`, for pacing; 0 for deleted files
+    and shards"""
+    sizes = []
+    for (status, path) in changes:
+        try:
+            st = Path(repo, path).lstat()
+            sizes.append(0 if S_ISDIR(st.st_mode) else st.st_size)
+        except FileNotFoundError:
+            sizes.append(0)  # Deleted
+    return sizes
+
+
+def statistics(repo):
+    """Number of files added/modified/deleted and bytes to be committed,
+    i.e., staged, as `{trailer: value}`"""
+    stats = {'Files-added': 0, 'Files-modified': 0, 'Files-deleted': 0,
+             'Bytes': 0}
+    ret = subprocess.run(['git', 'diff', '--cached', '--raw', '-z',
+                          '--no-renames', '--no-abbrev'],
+                         cwd=repo, capture_output=True, check=True)
+    fields = ret.stdout.split(b'\0')
+    blobs = []
+    for i in range(0, len(fields) - 1, 2):
+        # ":<old mode> <new mode> <old blob> <new blob> <status>", path
+        (_, mode, _, new, status) = fields[i].decode('ASCII').split(' ')
+        if status == 'D':
+            stats['Files-deleted'] += 1
+        else:
+            if status == 'A':
+                stats['Files-added'] += 1
+            else:
+                stats['Files-modified'] += 1
+            if mode != '160000':  # Shards count as modified, without size
+                blobs.append(new)
+    if blobs:
+        ret = subprocess.run(['git', 'cat-file',
+                              '--batch-check=%(objectsize)'],
+                             cwd=repo, capture_output=True, check=True,
+                             input='\n'.join(blobs) + '\n', text=True)
+        stats['Bytes'] = sum(int(size) for size in ret.stdout.split())
+    return stats
+
+
+def stage_paced(repo, changes, sizes):
+    """Stage `changes` (as found by `scan()`) in batches, within the
+    `--max-scan-rate`/`--max-read-rate` budget"""
+    budget = autoblockchainify.throttle.Budget(len(changes), sum(sizes),
+                                               shutdown)
+    batch_bytes = autoblockchainify.config.arg.max_read_rate or float('inf')
+    i = 0
+    while i < len(changes):
+        # At most one second worth of reading per batch
+        j = i + 1
+        size = sizes[i]
+        while (j < len(changes) and j - i < autoblockchainify.throttle.BATCH_FILES
+               and size + sizes[j] <= batch_bytes):
+            size += sizes[j]
+            j += 1
+        autoblockchainify.throttle.run(
+            ['git', '--literal-pathspecs',
+             '-c', 'advice.addEmbeddedRepo=false', 'add', '--all',
+             '--pathspec-from-file=-', '--pathspec-file-nul'],
+            cwd=repo, check=True,
+            input=b''.join(path.encode('UTF-8', 'surrogateescape') + b'\0'
+                           for (status, path) in changes[i:j]))
+        budget.spend(j - i, size)
+        i = j
+    budget.report('stage')
+
+
 def commit_current_state(repo):
     """Force a commit; will be called only if a commit has to be made.
     I.e., if there really are changes or the force duration has expired."""
-    now = datetime.now(timezone.utc)
+    global changeset
+    now = autoblockchainify.clock.now()
     nowstr = now.strftime('%Y-%m-%d %H:%M:%S UTC')
-    subprocess.run(['git', 'add', '.'],
-                   cwd=repo, check=True)
-    subprocess.run(['git', 'commit', '--allow-empty',
-                    '-m', "🔗 Autoblockchainify data as of " + nowstr],
-                   cwd=repo, check=True)
+    if autoblockchainify.throttle.limited():
+        stage_paced(repo, changeset, file_sizes(repo, changeset))
+    else:
+        autoblockchainify.throttle.run(
+            ['git', '-c', 'advice.addEmbeddedRepo=false', 'add', '.'],
+            cwd=repo, check=True)
+    changeset = []
+    # From what is actually being committed, not from the scan
+    stats = statistics(repo)
+    try:
+        autoblockchainify.throttle.run(
+            ['git', 'commit', '--allow-empty',
+             '-m', "🔗 Autoblockchainify data as of " + nowstr,
+             '-m', '\n'.join("%s: %d" % item for item in stats.items())],
+            cwd=repo, check=True)
+        autoblockchainify.metrics.update({
+            'commit.' + key.lower().replace('-', '_'): value
+            for (key, value) in stats.items()})
+        for (key, value) in stats.items():
+            autoblockchainify.metrics.inc(
+                'total.' + key.lower().replace('-', '_'), value)
+    finally:
+        # The commit includes whatever files have changed
+        autoblockchainify.repository.context.changed_head()
+        autoblockchainify.repository.context.changed()
+    autoblockchainify.metrics.update({
+        'commit.last_time': autoblockchainify.clock.time(),
+        'commit.last_id': autoblockchainify.repository.context.head_hex(),
+    })
+
+
+def remove_stale_lock(repo):
+    """Remove an `index.lock` left behind by a `git` process which was
+    killed together with the daemon. Only to be called at startup,
+    when the journal shows that a cycle has been interrupted."""
+    lock = Path(repo, '.git', 'index.lock')
+    if lock.is_file():
+        logging.warning("Removing stale %s from interrupted cycle", lock)
+        lock.unlink()
 
 
 def head_older_than(repo, duration):
     """Check whether the last commit is older than `duration`.
     Unborn HEAD is *NOT* considered to be older; as a result,
     the first commit will be done only after the first change."""
-    r = git.Repository(repo)
-    if r.head_is_unborn:
+    commit_time = autoblockchainify.repository.context.head_time()
+    if commit_time is None:
         return False
-    now = datetime.utcnow()
-    return datetime.utcfromtimestamp(
-        r.head.peel().commit_time) + duration < now
+    now = autoblockchainify.clock.utcnow()
+    return datetime.utcfromtimestamp(commit_time) + duration < now
+
+
+def cycle_stages():
+    """The stages of a commit cycle, in order, for the journal."""
+    stages = ['commit']
+    for r in autoblockchainify.config.arg.zeitgitter_servers:
+        stages.append('timestamp ' + r)
+    for r in autoblockchainify.config.arg.push_repository:
+        stages.append('push ' + r)
+    if autoblockchainify.config.arg.mail_accounts:
+        stages.append('mail')
+    return stages
+
+
+def commit_stage(repo, journal):
+    # After an interruption, the commit may already have been made
+    if (autoblockchainify.repository.context.head_hex()
+            == journal.state['parent']):
+        commit_current_state(repo)
+    else:
+        logging.info("Commit already made before interruption")
+    if not autoblockchainify.config.arg.no_content_index:
+        try:
+            autoblockchainify.index.update(
+                repo, autoblockchainify.index.BATCH)
+        except Exception:
+            # The index can catch up with the next commit
+            logging.exception("Updating the content index failed")
+    if autoblockchainify.config.arg.seal_after is not None:
+        try:
+            autoblockchainify.seal.seal(repo)
+        except Exception:
+            # Sealing can be retried, timestamping must go on
+            logging.exception("Sealing failed")
+
+
+def timestamp_stage(repo, target, pause):
+    """Timestamp HEAD with `target`, after `--zeitgitter-sleep` if `pause`.
+    Returns `'deferred'`, `'covered'` or `'requested'`."""
+    head = autoblockchainify.repository.context.head_hex()
+    deferred = timestamp_deferred(target, head)
+    if deferred == 'deferred':
+        logging.info("Postponing timestamp by %s to coalesce with "
+                     "later commits", target)
+        return deferred
+    elif deferred == 'covered':
+        logging.info("%s already covered by %s", head, target)
+        return deferred
+    if pause:
+        autoblockchainify.clock.sleep(
+            autoblockchainify.config.arg.zeitgitter_sleep.total_seconds())
+    logging.pending("Timestamping with %s", target,
+                    level=signale.DEBUG)
+    if '=' in target:
+        (branch, server) = target.split('=', 1)
+        success = cross_timestamp(repo, ['--branch', branch,
+                                         '--server', server], server)
+    else:
+        success = cross_timestamp(repo, ['--server', target], target)
+    if success:
+        timestamped[target] = (head, autoblockchainify.clock.time())
+        autoblockchainify.metrics.set(
+            'timestamp.%s.last_time' % target, timestamped[target][1])
+    autoblockchainify.metrics.set('timestamp.%s.failed' % target,
+                                  not success)
+    return 'requested'
+
+
+def push_stage(repo, target):
+    # Metrics are published by the status server, without credentials
+    name = autoblockchainify.push.redacted(target)
+    logging.pending("Pushing upstream to %s", name)
+    success = push_upstream(repo, target,
+                            autoblockchainify.config.arg.push_branch)
+    if success:
+        autoblockchainify.metrics.update({
+            'push.%s.last_time' % name:
+                autoblockchainify.clock.time(),
+            'push.%s.last_id' % name:
+                autoblockchainify.repository.context.head_hex(),
+        })
+    autoblockchainify.metrics.set('push.%s.failed' % name, not success)
+
+
+def run_stages(repo, journal):
+    """Perform all stages still pending in the journal, recording each
+    one as soon as it has been completed. A failing stage (also one raising
+    an exception, e.g. if `git timestamp` is missing) is logged and counts
+    as completed, as before; the journal only protects against
+    interruption. Timestamps postponed by `--timestamp-window` remain
+    pending in the journal, as do the pushes, which have to publish them
+    later."""
+    first_timestamp = True
+    postponed = False
+    for stage in journal.pending():
+        (kind, _, target) = stage.partition(' ')
+        try:
+            if kind == 'commit':
+                commit_stage(repo, journal)
+            elif kind == 'timestamp':
+                result = timestamp_stage(repo, target, not first_timestamp)
+                if result == 'deferred':
+                    journal.defer(stage)
+                    postponed = True
+                    continue
+                elif result == 'requested':
+                    first_timestamp = False
+            elif kind == 'push':
+                push_stage(repo, target)
+            elif kind == 'mail':
+                autoblockchainify.mail.async_email_timestamp()
+            else:
+                logging.warning("Ignoring unknown journal stage %r", stage)
+        except Exception:
+            # Retrying it in every cycle would block all further commits
+            logging.exception("Stage %r failed", stage)
+            if kind == 'push':
+                target = autoblockchainify.push.redacted(target)
+            if kind in ('timestamp', 'push'):
+                autoblockchainify.metrics.set(
+                    '%s.%s.failed' % (kind, target), True)
+        journal.done(stage)
+    if postponed:
+        for stage in journal.state['stages']:
+            if stage.startswith('push '):
+                journal.defer(stage)
+    if not journal.pending():
+        journal.finish()
 
 
 def do_commit():
     """To be called in a non-daemon thread to reduce possibilities of
     early termination.
 
+    0. Resume the stages of a previous cycle which has been interrupted
+       (as recorded in the journal), if any.
     1. Commit if
        * there is anything uncommitted, or
        * more than FORCE_AFTER_INTERVALS intervals have passed since the
@@ -107,68 +405,84 @@ def do_commit():
     3. (Optionally) push
     4. (Optionally) cross-timestamp using email (asynchronous), if the previous
        email has been sent more than FORCE_AFTER_INTERVALS ago. The response
-       will be added to a future commit."""
-    logging.start("do_commit", suffix="Threads: " +
-                  str(threading.enumerate()), level=signale.XDEBUG)
+       will be added to a future commit.
+    Completion of each of the steps 1-4 is recorded in the journal.
+    Timestamps postponed by the previous cycle are requested by this one,
+    for the new commit if there is one."""
+    autoblockchainify.log.new_cycle()
+    logging.start("do_commit", level=signale.XDEBUG,
+                  suffix=lambda: "Threads: " + str(threading.enumerate()))
     # Allow 5% of an interval tolerance, such that small timing differences
     # will not lead to lengthening the duration by one commit_interval.
     # This is as early as possible, because mail timestamps will be delayed for
     # number_of_timestampers * zeitgitter_sleep + connection_plus_work_delays
     force_interval = (autoblockchainify.config.arg.commit_interval
                       * (autoblockchainify.config.arg.force_after_intervals - 0.95))
+    autoblockchainify.metrics.update({
+        'scheduler.cycle_running': True,
+        'scheduler.cycle_start': autoblockchainify.clock.time(),
+    })
     try:
         repo = autoblockchainify.config.arg.repository
-        # If a merge (a manual process on the repository) is detected,
-        # try to not interfere with the manual process and wait for the
-        # next forced update
-        if ((has_user_changes(repo) and not pending_merge(repo))
-                or head_older_than(repo, force_interval)
-                or autoblockchainify.mail.needs_timestamp()):
-            # 1. Commit
-            commit_current_state(repo)
-
-            # 2. Timestamp (synchronously) using Zeitgitter
-            repositories = autoblockchainify.config.arg.push_repository
-            branches = autoblockchainify.config.arg.push_branch
-            first = True
-            for r in autoblockchainify.config.arg.zeitgitter_servers:
-                if first:
-                    first = False
-                else:
-                    time.sleep(
-                        autoblockchainify.config.arg.zeitgitter_sleep.total_seconds())
-                logging.pending("Timestamping with %s" %
-                                r, level=signale.DEBUG)
-                if '=' in r:
-                    (branch, server) = r.split('=', 1)
-                    cross_timestamp(repo, ['--branch', branch,
-                                           '--server', server], server)
-                else:
-                    cross_timestamp(repo, ['--server', r], r)
-
-            # 3. Push
-            for r in repositories:
-                logging.pending("Pushing upstream to %s" % r)
-                push_upstream(repo, r, branches)
-
-            # 4. Timestamp by mail (asynchronously)
-            if autoblockchainify.config.arg.stamper_own_address:
-                autoblockchainify.mail.async_email_timestamp()
+        with serialize_commit:
+            if autoblockchainify.config.arg.seal_after is not None:
+                try:
+                    autoblockchainify.seal.check(repo)
+                except Exception:
+                    # Checked again next round, committing must go on
+                    logging.exception("Checking sealed files failed")
+            journal = autoblockchainify.journal.Journal(repo)
+            resume = journal.load() and not journal.only_deferred()
+            if (not resume
+                    and autoblockchainify.config.arg.shard_subdirectories):
+                autoblockchainify.shard.commit_shards(repo)
+            if resume:
+                logging.pending("Resuming interrupted cycle: %s",
+                                ', '.join(journal.pending()))
+                if 'commit' in journal.pending():
+                    # `changeset` predates the interruption, if set at all
+                    scan(repo)
+                run_stages(repo, journal)
+            # If a merge (a manual process on the repository) is detected,
+            # try to not interfere with the manual process and wait for the
+            # next forced update
+            elif ((has_user_changes(repo) and not pending_merge(repo))
+                    or head_older_than(repo, force_interval)
+                    or autoblockchainify.mail.needs_timestamp()):
+                # Supersedes any postponed timestamps
+                journal.begin(autoblockchainify.repository.context.head_hex(),
+                              cycle_stages())
+                run_stages(repo, journal)
+            elif journal.pending():
+                logging.pending("Requesting postponed timestamps: %s",
+                                ', '.join(journal.pending()))
+                run_stages(repo, journal)
 
         logging.complete("do_commit done at " +
-                         datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC'))
+                         autoblockchainify.clock.utcnow()
+                         .strftime('%Y-%m-%d %H:%M:%S UTC'))
     except Exception:
         logging.exception("Unhandled exception in commit thread")
+    finally:
+        autoblockchainify.metrics.set('scheduler.cycle_running', False)
 
 
 def loop():
-    """Run at given interval and offset"""
-    interval = autoblockchainify.config.arg.commit_interval.total_seconds()
-    offset = autoblockchainify.config.arg.commit_offset.total_seconds()
+    """Run at given interval and offset, until `shutdown` is set.
+    A configuration reload is applied at the start of a cycle."""
     while True:
-        now = time.time()
+        interval = autoblockchainify.config.arg.commit_interval.total_seconds()
+        offset = autoblockchainify.config.arg.commit_offset.total_seconds()
+        now = autoblockchainify.clock.time()
         until = now - (now % interval) + offset
         if until <= now:
             until += interval
-        time.sleep(until - now)
+        autoblockchainify.metrics.set('scheduler.next_cycle', until)
+        if autoblockchainify.clock.wait(shutdown, until - now):
+            logging.stop("Shutting down, no further commit cycles")
+            autoblockchainify.metrics.set('scheduler.stopping', True)
+            return
+        if reload_requested.is_set():
+            reload_requested.clear()
+            autoblockchainify.config.reload()
         threading.Thread(target=do_commit, name="commit", daemon=False).start()
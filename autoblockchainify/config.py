@@ -27,16 +27,101 @@ import signale
 import os
 import sys
 import random
+import re
 import deltat
 
+import autoblockchainify.log
 import autoblockchainify.version
 
 
-logging = signale.Signale({"scope": "config"})
+logging = autoblockchainify.log.Logger("config")
 
 
-def get_args(args=None, config_file_contents=None):
-    global arg
+def parse_duration(value, option):
+    """`deltat.parse_time(value)`, exiting with an error message on invalid
+    input (as for any other invalid option)"""
+    try:
+        return deltat.parse_time(value)
+    except ValueError as e:
+        sys.exit("%s: %s" % (option, e))
+
+
+def parse_size(size):
+    """Parse a byte count with optional `k`/`M`/`G` suffix (powers of 1024);
+    `None` if invalid"""
+    factor = 1
+    for (suffix, f) in (('k', 1 << 10), ('M', 1 << 20), ('G', 1 << 30)):
+        if size.endswith(suffix):
+            (size, factor) = (size[:-1], f)
+            break
+    try:
+        return float(size) * factor
+    except ValueError:
+        return None
+
+
+STAMPER_KEYS = ('own-address', 'smtp-server', 'imap-server', 'username',
+                'password', 'to', 'from', 'keyid')
+
+
+def stamper_accounts(arg):
+    """The mail accounts for the PGP Digital Timestamping Service, as dicts
+    with `name` and `STAMPER_KEYS`: `default` from the `--stamper-*`
+    options (if `--stamper-own-address` is given), followed by those from
+    `--stamper-accounts`"""
+    defaults = {key: getattr(arg, 'stamper_' + key.replace('-', '_'))
+                for key in STAMPER_KEYS}
+    accounts = []
+    if arg.stamper_own_address:
+        accounts.append(dict(defaults, name='default'))
+    if arg.stamper_accounts:
+        import configparser
+        ini = configparser.ConfigParser(interpolation=None)
+        try:
+            with open(arg.stamper_accounts) as f:
+                ini.read_file(f)
+        except (OSError, configparser.Error) as e:
+            sys.exit("Cannot read --stamper-accounts: %s" % e)
+        for name in ini.sections():
+            section = ini[name]
+            if name == 'default' or not re.fullmatch(r'[-\w]+', name):
+                sys.exit("--stamper-accounts: invalid account name %r" % name)
+            unknown = set(section) - set(STAMPER_KEYS)
+            if unknown:
+                sys.exit("--stamper-accounts: unknown key(s) %s in [%s]"
+                         % (', '.join(sorted(unknown)), name))
+            account = dict(defaults, name=name)
+            account.update(section)
+            if 'own-address' in section and 'username' not in section:
+                account['username'] = section['own-address']
+            for key in ('own-address', 'smtp-server', 'imap-server'):
+                if not account[key]:
+                    sys.exit("--stamper-accounts: [%s] needs %s"
+                             % (name, key))
+            accounts.append(account)
+    return accounts
+
+
+def get_args(args=None, config_file_contents=None, previous=None):
+    """Parse and validate the configuration, then make it `arg`. `previous`
+    is the configuration being replaced when reloading. Other threads may
+    be using `arg`, so it is replaced by a single assignment, and only then
+    are the log settings applied."""
+    global arg, parse_params
+    new = parse(args, config_file_contents, previous)
+    parse_params = (args, config_file_contents)
+    arg = new
+    autoblockchainify.log.reset_thresholds()
+    for (logger, lvl) in arg.log_thresholds:
+        autoblockchainify.log.set_threshold(logger, lvl)
+    autoblockchainify.log.configure(arg.log_format,
+                                    arg.log_repeat_window.total_seconds())
+    logging.success("Settings applied: %s", arg, level=signale.DEBUG)
+    return arg
+
+
+def parse(args, config_file_contents, previous):
+    """The configuration as a new namespace; exits if it is invalid"""
     # Config file in /etc or the program directory
     parser = configargparse.ArgumentParser(
         auto_env_var_prefix="autoblockchainify_",
@@ -55,10 +140,28 @@ def get_args(args=None, config_file_contents=None):
                             Debug levels for specific loggers can also be
                             specified using 'name=level'. Valid logger names:
                             `config`, `daemon`, `commit` (incl. requesting
-                            timestamps), `gnupg`, `mail` (interfacing with PGP
-                            Timestamping Server).  Example: `DEBUG,gnupg=INFO`
-                            sets the default debug level to DEBUG, except for
-                            `gnupg`.""")
+                            timestamps), `index`, `seal`, `shard`, `status`,
+                            `gnupg`, `mail`
+                            (interfacing with PGP Timestamping Server).
+                            Example: `DEBUG,gnupg=INFO` sets the default debug
+                            level to DEBUG, except for `gnupg`.""")
+    parser.add_argument('--log-format',
+                        default='text',
+                        help="""`text` for human-readable output, `json` for
+                            one JSON object per line, including the ID of
+                            the commit cycle a message belongs to.""")
+    parser.add_argument('--log-repeat-window',
+                        default='1m',
+                        help="""Suppress identical messages repeated within
+                            this time; the number of repetitions is shown
+                            with the next one. Errors are never suppressed.
+                            `0` disables this.""")
+    parser.add_argument('--status-listen',
+                        help="""Serve `/healthz` and `/status` over HTTP on
+                            `<host>:<port>` or on the Unix domain socket
+                            `unix:<path>`. Answered from memory, without
+                            accessing the repository. Not changed by a
+                            configuration reload.""")
     parser.add_argument('--version',
                         action='version', version=autoblockchainify.version.VERSION)
 
@@ -88,6 +191,29 @@ def get_args(args=None, config_file_contents=None):
     parser.add_argument('--repository',
                         default='.',
                         help="""path to the GIT repository (default '.')""")
+    parser.add_argument('--no-content-index', action='store_true',
+                        help="""Do not maintain the index of file versions
+                            and the commits they first/last appeared in
+                            (`.git/autoblockchainify-index.sqlite`, queried
+                            with `autoblockchainify-lookup`)""")
+    parser.add_argument('--seal-after',
+                        help="""Seal committed files which have not been
+                            modified for this long (e.g. `30d`): They are
+                            no longer scanned by `git status`; instead, they
+                            are checked for modifications once per force
+                            interval, which will be reported as an integrity
+                            alert. Useful for append-only archives.
+                            Default: Never seal.""")
+    parser.add_argument('--shard-subdirectories', action='store_true',
+                        help="""Track every top-level subdirectory as a git
+                            repository of its own (a shard), committed in
+                            parallel. The repository records the shards'
+                            commits and is the only one timestamped and
+                            pushed.""")
+    parser.add_argument('--shard-workers',
+                        type=int,
+                        help="""Number of shards committed in parallel.
+                            Default: number of CPUs.""")
     parser.add_argument('--zeitgitter-servers',
                         default='diversity gitta',
                         help="""any number of space-separated
@@ -95,11 +221,44 @@ def get_args(args=None, config_file_contents=None):
                              `[<branch>=]<server>`. The server name will
                              be passed with `--server` to `git timestamp`,
                              the (optional) branch name with `--branch`.""")
+    parser.add_argument('--timestamp-window',
+                        default='0s',
+                        help="""Do not request another timestamp from a
+                            Zeitgitter server within this time after the
+                            previous one, but postpone it to a later commit
+                            cycle, covering all commits made until then. At
+                            most `--force-after-intervals` - 1 times
+                            `--commit-interval`.""")
     parser.add_argument('--zeitgitter-sleep',
                         default='0s',
                         help="""Delay between cross-timestamping for the
                              different timestampers""")
 
+    # Resource limits
+    parser.add_argument('--nice',
+                        type=int, default=0,
+                        help="""Increase the niceness of `git` scanning and
+                            committing by this amount""")
+    parser.add_argument('--ionice-class',
+                        default='',
+                        help="""I/O scheduling class (`idle` or
+                            `best-effort`) for `git` scanning and committing.
+                            Default: unchanged.""")
+    parser.add_argument('--max-scan-rate',
+                        type=float,
+                        help="""Maximum number of changed files to add to a
+                            commit per second. Default: unlimited.""")
+    parser.add_argument('--max-read-rate',
+                        help="""Maximum number of bytes of changed files to
+                            read (hash) per second, e.g. `10M`. Default:
+                            unlimited. With this or `--max-scan-rate`, the
+                            work is spread over at most half of
+                            `--commit-interval`.""")
+    parser.add_argument('--cgroup',
+                        help="""Path of an existing (v2) cgroup directory to
+                            run the daemon in, e.g. to limit its memory or
+                            I/O bandwidth""")
+
     # Pushing
     parser.add_argument('--push-repository',
                         default='',
@@ -109,6 +268,11 @@ def get_args(args=None, config_file_contents=None):
                         default='*',
                         help="""Space-separated list of branches to push.
                             `*` means all, as `--all` is eaten by ConfigArgParse""")
+    parser.add_argument('--no-ssh-multiplexing', action='store_true',
+                        help="""Do not keep SSH connections to the push
+                            repositories open between commit cycles (only
+                            used if `GIT_SSH`/`GIT_SSH_COMMAND` and
+                            `core.sshCommand` are unset)""")
 
     # PGP Digital Timestamper interface
     parser.add_argument('--stamper-own-address', '--mail-address', '--email-address',
@@ -142,10 +306,26 @@ def get_args(args=None, config_file_contents=None):
                             SEARCH, so this cuts off the last char from
                             `stamper-from`. Should not impact other mail
                             servers.""")
+    parser.add_argument('--stamper-accounts',
+                        help="""INI file with further mail accounts (e.g.,
+                            with other providers), one section per account.
+                            The section name names the account; the keys
+                            `own-address`, `smtp-server`, `imap-server`,
+                            `username`, `password`, `to`, `from` and `keyid`
+                            default to the corresponding `--stamper-*`
+                            option. Replies are stored in
+                            `pgp-timestamp-<name>.sig`.""")
+    parser.add_argument('--stamper-mode',
+                        default='concurrent',
+                        help="""`concurrent`: request timestamps through all
+                            accounts; `failover`: through the first account
+                            which has not failed (could not send or received
+                            no reply) within the force interval.""")
 
     arg = parser.parse_args(
         args=args, config_file_contents=config_file_contents)
 
+    arg.log_thresholds = []
     for level in str(arg.debug_level).split(','):
         if '=' in level:
             (logger, lvl) = level.split('=', 1)
@@ -157,16 +337,29 @@ def get_args(args=None, config_file_contents=None):
             lvl = signale.WARNING - lvl * (signale.WARNING - signale.INFO)
         except ValueError:
             pass
-        signale.set_threshold(logger, lvl)
+        arg.log_thresholds.append((logger, lvl))
+    if arg.log_format not in ('text', 'json'):
+        sys.exit("--log-format must be `text` or `json`")
+    arg.log_repeat_window = parse_duration(
+        arg.log_repeat_window, '--log-repeat-window')
+
+    if previous is not None and arg.repository != previous.repository:
+        logging.warning("Changing --repository requires a restart, "
+                        "staying with %s", previous.repository)
+        arg.repository = previous.repository
 
     if arg.stamper_username is None:
         arg.stamper_username = arg.stamper_own_address
+    if arg.stamper_mode not in ('concurrent', 'failover'):
+        sys.exit("--stamper-mode must be `concurrent` or `failover`")
+    arg.mail_accounts = stamper_accounts(arg)
 
     if arg.force_after_intervals < 2:
         sys.exit("--force-after-intervals must be >= 2")
 
-    arg.commit_interval = deltat.parse_time(arg.commit_interval)
-    if arg.stamper_own_address is None:
+    arg.commit_interval = parse_duration(
+        arg.commit_interval, '--commit-interval')
+    if not arg.mail_accounts:
         if arg.commit_interval < datetime.timedelta(minutes=1):
             sys.exit("--commit-interval may not be shorter than 1m")
     else:
@@ -175,19 +368,48 @@ def get_args(args=None, config_file_contents=None):
                      "not be shorter than 10m when using the (mail-based) "
                      "PGP Digital Timestamping Service")
 
-    if arg.commit_offset is None:
+    arg.random_commit_offset = arg.commit_offset is None
+    if (arg.random_commit_offset and previous is not None
+            and previous.random_commit_offset
+            and previous.commit_interval == arg.commit_interval):
+        # Keep the offset when reloading
+        arg.commit_offset = previous.commit_offset
+    elif arg.random_commit_offset:
         # Avoid the seconds around the full interval, to avoid clustering
         # with other system activity.
         arg.commit_offset = arg.commit_interval * random.uniform(0.05, 0.95)
-        logging.info("Chose --commit-offset %s" % arg.commit_offset)
+        logging.info("Chose --commit-offset %s", arg.commit_offset)
     else:
-        arg.commit_offset = deltat.parse_time(arg.commit_offset)
+        arg.commit_offset = parse_duration(
+            arg.commit_offset, '--commit-offset')
     if arg.commit_offset < datetime.timedelta(seconds=0):
         sys.exit("--commit-offset must be positive")
     if arg.commit_offset >= arg.commit_interval:
         sys.exit("--commit-offset must be less than --commit-interval")
 
-    arg.zeitgitter_sleep = deltat.parse_time(arg.zeitgitter_sleep)
+    arg.zeitgitter_sleep = parse_duration(
+        arg.zeitgitter_sleep, '--zeitgitter-sleep')
+    arg.timestamp_window = parse_duration(
+        arg.timestamp_window, '--timestamp-window')
+    if (arg.timestamp_window
+            > arg.commit_interval * (arg.force_after_intervals - 1)):
+        sys.exit("--timestamp-window must not exceed "
+                 "(--force-after-intervals - 1) * --commit-interval")
+    if arg.seal_after is not None:
+        arg.seal_after = parse_duration(arg.seal_after, '--seal-after')
+
+    if arg.shard_workers is not None and arg.shard_workers < 1:
+        sys.exit("--shard-workers must be positive")
+    if arg.ionice_class not in ('', 'idle', 'best-effort'):
+        sys.exit("--ionice-class must be `idle` or `best-effort`")
+    if arg.nice < 0:
+        sys.exit("--nice must not be negative")
+    if arg.max_scan_rate is not None and arg.max_scan_rate <= 0:
+        sys.exit("--max-scan-rate must be positive")
+    if arg.max_read_rate is not None:
+        arg.max_read_rate = parse_size(arg.max_read_rate)
+        if arg.max_read_rate is None or arg.max_read_rate <= 0:
+            sys.exit("--max-read-rate must be a positive size, e.g. `10M`")
 
     # Work around ConfigArgParse list bugs by implementing lists ourselves
     arg.zeitgitter_servers = arg.zeitgitter_servers.split()
@@ -201,6 +423,21 @@ def get_args(args=None, config_file_contents=None):
 
     if not arg.no_dovecot_bug_workaround:
         arg.stamper_from = arg.stamper_from[:-1]  # See help text
-
-    logging.success("Settings applied: %s" % str(arg), level=signale.DEBUG)
+        for account in arg.mail_accounts:
+            account['from'] = account['from'][:-1]
     return arg
+
+
+def reload():
+    """Re-read the configuration (files and command line) after a SIGHUP.
+    Settings which cannot be changed at runtime are kept:
+    * the repository, whose state is cached, and
+    * a randomly chosen commit offset, as long as the interval is unchanged.
+    On error, the previous configuration stays in effect."""
+    try:
+        get_args(*parse_params, previous=arg)
+    except SystemExit as e:
+        logging.error("Configuration not reloaded: %s", e)
+        return False
+    logging.success("Configuration reloaded")
+    return True
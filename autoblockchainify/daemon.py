@@ -21,16 +21,24 @@
 # Set up the daemon
 
 
+import signal
 import signale
 import subprocess
+import threading
 from pathlib import Path
 
 import autoblockchainify.commit
 import autoblockchainify.config
+import autoblockchainify.journal
+import autoblockchainify.log
+import autoblockchainify.metrics
+import autoblockchainify.repository
+import autoblockchainify.status
+import autoblockchainify.throttle
 import autoblockchainify.version
 
 
-logging = signale.Signale({"scope": "daemon"})
+logging = autoblockchainify.log.Logger("daemon")
 try:
     # Aligned output, if supported by this version of Signale
     signale.set_align(8, 8)
@@ -51,7 +59,7 @@ def finish_setup(arg):
         # Ignore 'pgp-timestamper.rev'
         if not Path(repo, '.gitignore').is_file():
             with open(Path(repo, '.gitignore'), 'a') as ignore:
-                ignore.write('''pgp-timestamp.tmp
+                ignore.write('''pgp-timestamp*.tmp
 .gnupg/
 .ssh/
 ''')
@@ -64,11 +72,52 @@ def finish_setup(arg):
                        cwd=repo, check=True)
 
 
+def resume_interrupted_cycle(arg):
+    """If the previous daemon was stopped in the middle of a commit cycle,
+    clean up after it and finish the remaining stages right away."""
+    repo = arg.repository
+    journal = autoblockchainify.journal.Journal(repo)
+    # Postponed timestamps are left to the regular cycles
+    if journal.load() and not journal.only_deferred():
+        autoblockchainify.commit.remove_stale_lock(repo)
+        threading.Thread(target=autoblockchainify.commit.do_commit,
+                         name="commit_resume", daemon=False).start()
+
+
+def graceful_shutdown(signum, frame):
+    """Do not start new cycles; a cycle already running (in its non-daemon
+    thread) is allowed to complete."""
+    logging.stop("Received signal %d, shutting down", signum)
+    autoblockchainify.commit.shutdown.set()
+
+
+def request_reload(signum, frame):
+    """Reload the configuration at the start of the next cycle, without
+    disturbing a running cycle or pending mail replies."""
+    logging.pending("Received signal %d, reloading configuration "
+                    "at next cycle", signum)
+    autoblockchainify.commit.reload_requested.set()
+
+
 def run():
     autoblockchainify.config.get_args()
     finish_setup(autoblockchainify.config.arg)
+    autoblockchainify.throttle.join_cgroup()
+    context = autoblockchainify.repository.open_context(
+        autoblockchainify.config.arg.repository)
+    if autoblockchainify.config.arg.status_listen:
+        # Only then worth loading `pygit2` before the first commit cycle
+        autoblockchainify.metrics.update({
+            'commit.last_time': context.head_time(),
+            'commit.last_id': context.head_hex(),
+        })
+        autoblockchainify.status.serve(
+            autoblockchainify.config.arg.status_listen)
+    signal.signal(signal.SIGTERM, graceful_shutdown)
+    signal.signal(signal.SIGHUP, request_reload)
+    resume_interrupted_cycle(autoblockchainify.config.arg)
     # Try to resume waiting for a PGP Timestamping Server reply, if any
-    if autoblockchainify.config.arg.stamper_own_address:
+    if autoblockchainify.config.arg.mail_accounts:
         logging.pending("possibly resuming cross-timestamping by mail")
         autoblockchainify.mail.async_email_timestamp(resume=True)
     autoblockchainify.commit.loop()
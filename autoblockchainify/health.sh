@@ -1,6 +1,11 @@
 #!/bin/sh -e
 # Docker healthcheck
 
+# Ask the daemon itself, if it serves its status (much cheaper)
+if [ -n "$AUTOBLOCKCHAINIFY_STATUS_LISTEN" ]; then
+  exec python3 -m autoblockchainify.status /healthz
+fi
+
 # Have there been commits at all?
 if [ ! -f /blockchain/.git/refs/heads/master ]; then
   exit 0
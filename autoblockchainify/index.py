@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Index of file contents: When was which version of a file first committed?
+# Also records which commits are referenced by Zeitgitter timestamps (on the
+# `*-timestamps` branches) and named by PGP Digital Timestamping Service
+# signatures (`pgp-timestamp*.sig`), for `autoblockchainify-proof`.
+
+import argparse
+import re
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import autoblockchainify.log
+
+logging = autoblockchainify.log.Logger("index")
+
+# Commits indexed per commit cycle, such that indexing an existing history
+# does not delay the timestamps; it is spread over several cycles instead
+BATCH = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    first_commit TEXT NOT NULL,
+    first_time INTEGER NOT NULL,
+    last_commit TEXT,
+    last_time INTEGER,
+    PRIMARY KEY (path, blob)
+);
+CREATE INDEX IF NOT EXISTS files_blob ON files (blob);
+CREATE TABLE IF NOT EXISTS timestamps (
+    commit_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (commit_id, timestamp)
+);
+CREATE TABLE IF NOT EXISTS signatures (
+    commit_id TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    PRIMARY KEY (commit_id, blob)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def index_path(repo):
+    return Path(repo, '.git', 'autoblockchainify-index.sqlite')
+
+
+def connect(repo):
+    import sqlite3  # Only needed after the first commit, speeds up startup
+    db = sqlite3.connect(str(index_path(repo)))
+    db.executescript(SCHEMA)
+    return db
+
+
+def get_meta(db, key):
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+
+def set_meta(db, key, value):
+    db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+               (key, value))
+
+
+def new_commits(repo, since):
+    """List of (commit, first parent, commit time) of all first-parent
+    commits after `since` up to HEAD, oldest first."""
+    revs = 'HEAD' if since is None else since + '..HEAD'
+    ret = subprocess.run(['git', 'log', '--first-parent', '--reverse',
+                          '--format=%H %P %ct', revs],
+                         cwd=repo, capture_output=True, check=True, text=True)
+    commits = []
+    for line in ret.stdout.splitlines():
+        fields = line.split()
+        parent = fields[1] if len(fields) > 2 else None
+        commits.append((fields[0], parent, int(fields[-1])))
+    return commits
+
+
+def changes(repo, parent, commit):
+    """The change set of `commit` relative to `parent`, as
+    (status, old blob, new blob, path) tuples."""
+    if parent is None:
+        cmd = ['git', 'diff-tree', '-r', '-z', '--no-renames',
+               '--no-commit-id', '--root', commit]
+    else:
+        cmd = ['git', 'diff-tree', '-r', '-z', '--no-renames',
+               parent, commit]
+    ret = subprocess.run(cmd, cwd=repo, capture_output=True, check=True)
+    fields = ret.stdout.split(b'\0')
+    for i in range(0, len(fields) - 1, 2):
+        # ":<old mode> <new mode> <old blob> <new blob> <status>", path
+        (_, _, old, new, status) = fields[i].decode('ASCII').split(' ')
+        yield (status, old, new, fields[i + 1].decode('UTF-8', 'surrogateescape'))
+
+
+def is_signature(path):
+    return path.startswith('pgp-timestamp') and path.endswith('.sig')
+
+
+def read_blobs(repo, blobs):
+    """Contents of `blobs` (`None` if missing), through a single
+    `git cat-file --batch`"""
+    ret = subprocess.run(['git', 'cat-file', '--batch'], cwd=repo,
+                         input=''.join(blob + '\n' for blob in blobs).encode(),
+                         capture_output=True, check=True)
+    out = ret.stdout
+    i = 0
+    for blob in blobs:
+        eol = out.index(b'\n', i)
+        header = out[i:eol].split()
+        if len(header) != 3:  # Missing
+            i = eol + 1
+            yield None
+            continue
+        size = int(header[2])
+        yield out[eol + 1:eol + 1 + size]
+        i = eol + 1 + size + 1
+
+
+def update_signatures(repo, db, blobs):
+    """Record the commits named by the signature files `blobs`"""
+    if not blobs:
+        return
+    for (blob, data) in zip(blobs, read_blobs(repo, blobs)):
+        if data is None:
+            continue
+        for commit in re.findall(rb'^git commit ([0-9a-f]+)$', data,
+                                 re.MULTILINE):
+            db.execute("INSERT OR IGNORE INTO signatures (commit_id, blob)"
+                       " VALUES (?, ?)", (commit.decode('ASCII'), blob))
+
+
+def update_timestamps(repo, db):
+    """Record the commits referenced by new timestamp commits on the
+    `*-timestamps` branches"""
+    ret = subprocess.run(['git', 'for-each-ref',
+                          '--format=%(objectname) %(refname)', 'refs/heads'],
+                         cwd=repo, capture_output=True, text=True, check=True)
+    for line in ret.stdout.splitlines():
+        (tip, ref) = line.split(' ', 1)
+        if not ref.endswith('-timestamps'):
+            continue
+        key = 'ref ' + ref
+        last = get_meta(db, key)
+        if last == tip:
+            continue
+        ret = subprocess.run(['git', 'rev-list', '--first-parent', '--parents',
+                              ref if last is None else last + '..' + ref],
+                             cwd=repo, capture_output=True, text=True)
+        if ret.returncode != 0:  # E.g., previous tip no longer exists
+            ret = subprocess.run(['git', 'rev-list', '--first-parent',
+                                  '--parents', ref], cwd=repo,
+                                 capture_output=True, text=True, check=True)
+        for ids in (line.split() for line in ret.stdout.splitlines()):
+            for commit in ids[1:]:
+                db.execute("INSERT OR IGNORE INTO timestamps"
+                           " (commit_id, timestamp) VALUES (?, ?)",
+                           (commit, ids[0]))
+        set_meta(db, key, tip)
+
+
+def update(repo, limit=None):
+    """Add the commits since the last update to the index, but at most
+    `limit` (oldest first); the rest is left for the next update.
+    New timestamps are always added."""
+    ret = subprocess.run(['git', 'rev-parse', '-q', '--verify', 'HEAD'],
+                         cwd=repo, capture_output=True, text=True)
+    if ret.returncode != 0:
+        return  # Unborn HEAD, nothing to index yet
+    db = connect(repo)
+    try:
+        with db:
+            update_timestamps(repo, db)
+            signatures = []
+            if get_meta(db, 'signatures') is None:
+                # Index created before signatures were recorded
+                signatures = [row[0] for row in db.execute(
+                    "SELECT blob FROM files WHERE path LIKE 'pgp-timestamp%'")]
+                set_meta(db, 'signatures', 'yes')
+            since = get_meta(db, 'head')
+            if since == ret.stdout.strip():
+                update_signatures(repo, db, signatures)
+                return
+            since_time = get_meta(db, 'head_time')
+            if since_time is not None:
+                since_time = int(since_time)
+            commits = new_commits(repo, since)
+            count = 0
+            for (commit, parent, commit_time) in commits[:limit]:
+                for (status, old, new, path) in changes(repo, parent, commit):
+                    if status in 'MDT':
+                        # Last seen in the parent
+                        db.execute("UPDATE files SET last_commit = ?, last_time = ?"
+                                   " WHERE path = ? AND blob = ?",
+                                   (parent, since_time, path, old))
+                    if status in 'AMT':
+                        db.execute("INSERT OR IGNORE INTO files"
+                                   " (path, blob, first_commit, first_time)"
+                                   " VALUES (?, ?, ?, ?)",
+                                   (path, new, commit, commit_time))
+                        # Might have been removed and restored since
+                        db.execute("UPDATE files SET last_commit = NULL,"
+                                   " last_time = NULL"
+                                   " WHERE path = ? AND blob = ?", (path, new))
+                        if is_signature(path):
+                            signatures.append(new)
+                since = commit
+                since_time = commit_time
+                count += 1
+            set_meta(db, 'head', since)
+            set_meta(db, 'head_time', since_time)
+            update_signatures(repo, db, signatures)
+        if count < len(commits):
+            logging.info("Indexed %d commit(s), %d remaining",
+                         count, len(commits) - count)
+        else:
+            logging.debug("Indexed %d commit(s)", count)
+    finally:
+        db.close()
+
+
+def lookup(repo, path=None, blob=None):
+    """Rows (path, blob, first commit, first time, last commit, last time)
+    for the given path and/or blob, oldest first. Last commit/time are
+    `None` for the current version."""
+    db = connect(repo)
+    try:
+        query = ("SELECT path, blob, first_commit, first_time,"
+                 " last_commit, last_time FROM files WHERE ")
+        if blob is None:
+            rows = db.execute(query + "path = ?", (path,))
+        elif path is None:
+            rows = db.execute(query + "blob = ?", (blob,))
+        else:
+            rows = db.execute(query + "path = ? AND blob = ?", (path, blob))
+        return sorted(rows.fetchall(), key=lambda row: row[3])
+    finally:
+        db.close()
+
+
+def timestamps(repo, commit):
+    """IDs of the timestamp commits referencing `commit`"""
+    db = connect(repo)
+    try:
+        return [row[0] for row in db.execute(
+            "SELECT timestamp FROM timestamps WHERE commit_id = ?", (commit,))]
+    finally:
+        db.close()
+
+
+def signatures(repo, commit):
+    """Blob IDs of the signature file versions naming `commit`"""
+    db = connect(repo)
+    try:
+        return [row[0] for row in db.execute(
+            "SELECT blob FROM signatures WHERE commit_id = ?", (commit,))]
+    finally:
+        db.close()
+
+
+def format_time(t):
+    if t is None:
+        return '-'
+    return datetime.fromtimestamp(t, timezone.utc).strftime(
+        '%Y-%m-%d %H:%M:%S UTC')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="""Look up when a file (or file contents, by blob ID) has
+            first and last been committed by autoblockchainify.""")
+    parser.add_argument('--repository',
+                        default='.',
+                        help="path to the GIT repository")
+    parser.add_argument('--blob',
+                        help="blob ID of the file contents")
+    parser.add_argument('--update', action='store_true',
+                        help="bring the index up to date first")
+    parser.add_argument('path', nargs='?',
+                        help="path of the file, relative to the repository")
+    arg = parser.parse_args(args)
+    if arg.path is None and arg.blob is None:
+        parser.error("path and/or --blob required")
+
+    if arg.update:
+        update(arg.repository)
+    elif not index_path(arg.repository).is_file():
+        sys.exit("No index in %s, use `--update` to create it"
+                 % arg.repository)
+    rows = lookup(arg.repository, arg.path, arg.blob)
+    for (path, blob, first_commit, first_time, last_commit, last_time) in rows:
+        print("%s %s first %s %s last %s %s"
+              % (path, blob, first_commit, format_time(first_time),
+                 last_commit or '-', format_time(last_time)))
+    return 0 if rows else 1
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Journal of the stages of a commit cycle, for resumption after a restart
+
+import json
+import os
+from pathlib import Path
+
+import autoblockchainify.log
+
+logging = autoblockchainify.log.Logger("commit")
+
+
+class Journal:
+    """Records which stages of the current commit cycle have been completed.
+
+    The journal lives inside `.git`, so it is never committed. It is written
+    atomically after every stage. If the daemon is stopped in the middle of
+    a cycle, the next cycle will find the remaining stages in the journal
+    and only perform those."""
+
+    def __init__(self, repo):
+        self.path = Path(repo, '.git', 'autoblockchainify-journal.json')
+        self.state = None
+
+    def load(self):
+        """Load the journal from disk; returns `True` if there are
+        unfinished stages."""
+        try:
+            with self.path.open() as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = None
+        except ValueError:
+            logging.warning("Ignoring corrupt journal %s", self.path)
+            self.state = None
+        return len(self.pending()) > 0
+
+    def pending(self):
+        if self.state is None:
+            return []
+        return [s for s in self.state['stages']
+                if s not in self.state['done']]
+
+    def begin(self, parent, stages):
+        """Start a new cycle on top of `parent` (commit ID as hex string or
+        `None` for an unborn HEAD), consisting of the given `stages`."""
+        self.state = {'parent': parent, 'stages': stages, 'done': [],
+                      'deferred': []}
+        self.save()
+
+    def done(self, stage):
+        self.state['done'].append(stage)
+        self.save()
+
+    def defer(self, stage):
+        """`stage` has intentionally been postponed to the next cycle;
+        if it has already been done, it is to be repeated there"""
+        if stage in self.state['done']:
+            self.state['done'].remove(stage)
+        if stage not in self.state['deferred']:
+            self.state['deferred'].append(stage)
+        self.save()
+
+    def only_deferred(self):
+        """Whether all pending stages have been postponed intentionally,
+        i.e., nothing has been interrupted"""
+        deferred = self.state.get('deferred', [])
+        return all(s in deferred for s in self.pending())
+
+    def finish(self):
+        self.state = None
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Logging on top of Signale
+#
+# * Messages are only formatted (`msg % args`, callable `suffix`) if they
+#   pass the threshold for their scope.
+# * Output is either Signale's text format or JSON lines (`--log-format`).
+# * Identical messages are suppressed for `--log-repeat-window`; the number
+#   of suppressed repetitions is added to the next one printed.
+# * Each commit cycle gets an ID, which is added to all messages logged by
+#   the cycle, including the mail threads it starts.
+
+import json
+import signale
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+
+# Default levels of the Signale logging methods
+LEVELS = {
+    'simple': signale.INFO, 'success': signale.INFO, 'start': signale.INFO,
+    'error': signale.ERROR, 'exception': signale.ERROR,
+    'warning': signale.WARNING, 'watch': signale.INFO, 'stop': signale.INFO,
+    'important': signale.WARNING, 'pending': signale.INFO,
+    'debug': signale.DEBUG, 'xdebug': signale.XDEBUG, 'info': signale.INFO,
+    'pause': signale.INFO, 'complete': signale.INFO, 'like': signale.INFO,
+}
+LEVEL_NAMES = {signale.XDEBUG: 'XDEBUG', signale.DEBUG: 'DEBUG',
+               signale.INFO: 'INFO', signale.WARNING: 'WARNING',
+               signale.ERROR: 'ERROR', signale.CRITICAL: 'CRITICAL'}
+
+thresholds = {None: signale.XDEBUG}
+log_format = 'text'
+repeat_window = 0
+repeats = {}  # (scope, method, text) → [time first printed, suppressed]
+repeats_lock = threading.Lock()
+current = threading.local()
+
+
+def set_threshold(scope, level):
+    """Like `signale.set_threshold()`, which is also called"""
+    signale.set_threshold(scope, level)
+    if isinstance(level, str):
+        level = getattr(signale, level.upper(), signale.XDEBUG)
+    thresholds[scope] = level
+
+
+def reset_thresholds():
+    """Forget all thresholds, before (re-)applying `--debug-level`.
+    As all messages pass `Logger`'s thresholds first, Signale's thresholds
+    for the scopes are just opened up."""
+    for scope in thresholds:
+        if scope is not None:
+            signale.set_threshold(scope, signale.XDEBUG)
+    thresholds.clear()
+    thresholds[None] = signale.XDEBUG
+
+
+def configure(fmt, window):
+    global log_format, repeat_window
+    log_format = fmt
+    repeat_window = window
+
+
+def new_cycle():
+    """Start a new commit cycle in this thread; returns its ID"""
+    current.cycle = uuid.uuid4().hex[:8]
+    return current.cycle
+
+
+def cycle():
+    return getattr(current, 'cycle', None)
+
+
+def in_cycle(target):
+    """Wrap `target` to run (in a new thread) as part of the current cycle"""
+    cycle_id = cycle()
+
+    def run(*args, **kwargs):
+        current.cycle = cycle_id
+        return target(*args, **kwargs)
+    return run
+
+
+class Logger:
+    """Drop-in replacement for a `signale.Signale` logger with a scope.
+    Messages can be given as `msg, *args` for formatting on demand."""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.signale = signale.Signale({"scope": scope})
+
+    def enabled(self, level):
+        return level >= thresholds.get(self.scope, thresholds[None])
+
+    def suppressed(self, method, text):
+        """Whether this is a repetition within `repeat_window`; otherwise,
+        the number of suppressed repetitions (possibly 0)"""
+        if repeat_window <= 0:
+            return 0
+        now = time.monotonic()
+        key = (self.scope, method, text)
+        with repeats_lock:
+            if len(repeats) > 1000:
+                for k in [k for (k, v) in repeats.items()
+                          if v[0] + repeat_window < now]:
+                    del repeats[k]
+            entry = repeats.get(key)
+            if entry is not None and entry[0] + repeat_window > now:
+                entry[1] += 1
+                return True
+            repeats[key] = [now, 0]
+            return 0 if entry is None else entry[1]
+
+    def emit(self, method, text, args, prefix, suffix, level):
+        if args:
+            text = text % args
+        text = str(text)
+        if level >= signale.ERROR:
+            count = 0  # Errors (and their tracebacks) are always shown
+        else:
+            count = self.suppressed(method, text)
+        if count is True:
+            return
+        if callable(suffix):
+            suffix = suffix()
+        if method == 'exception':
+            suffix = (str(suffix) + traceback.format_exc()).rstrip()
+            method = 'error'
+        if count > 0:
+            text += " (repeated %d times)" % count
+        cycle_id = cycle()
+        if log_format == 'json':
+            record = {
+                'time': datetime.now(timezone.utc).isoformat(),
+                'scope': self.scope,
+                'level': LEVEL_NAMES.get(level, level),
+                'type': method,
+                'msg': text,
+                'thread': threading.current_thread().name,
+            }
+            if cycle_id is not None:
+                record['cycle'] = cycle_id
+            if prefix:
+                record['prefix'] = str(prefix)
+            if suffix:
+                record['suffix'] = str(suffix)
+            sys.stderr.write(json.dumps(record, ensure_ascii=False) + '\n')
+            sys.stderr.flush()
+        else:
+            if not prefix and cycle_id is not None:
+                prefix = cycle_id
+            getattr(self.signale, method)(text, prefix=prefix, suffix=suffix,
+                                          level=level)
+
+
+def logging_method(method):
+    default = LEVELS[method]
+
+    def log(self, text="", *args, prefix="", suffix="", level=None):
+        if level is None:
+            level = default
+        if level >= thresholds.get(self.scope, thresholds[None]):
+            self.emit(method, text, args, prefix, suffix, level)
+    log.__name__ = method
+    return log
+
+
+for method in LEVELS:
+    setattr(Logger, method, logging_method(method))
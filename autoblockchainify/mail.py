@@ -23,22 +23,72 @@
 import signale
 import os
 import re
+import socket
 import subprocess
 import threading
-import time
 from datetime import datetime, timedelta
-from imaplib import IMAP4
 from pathlib import Path
-from smtplib import SMTP
-from time import gmtime, strftime
-
-import pygit2 as git
+from time import strftime
 
+import autoblockchainify.clock
 import autoblockchainify.config
+import autoblockchainify.log
+import autoblockchainify.metrics
+import autoblockchainify.repository
 
-logging = signale.Signale({"scope": "mail"})
-serialize_receive = threading.Lock()
+logging = autoblockchainify.log.Logger("mail")
 serialize_create = threading.Lock()
+# The reply to a request arrives within this time (the service answers
+# every full 5 minutes, plus delivery); otherwise, the account has failed
+REPLY_TIMEOUT = timedelta(minutes=4+5)
+
+# Per account name: Lock for receiving, time of the last failure
+receive_locks = {}
+failed = {}
+
+
+def accounts():
+    """The mail accounts (dicts, see `config.stamper_accounts()`)"""
+    return autoblockchainify.config.arg.mail_accounts
+
+
+def logfile_name(account):
+    """The pending request (removed when the reply has been received)"""
+    if account['name'] == 'default':
+        return 'pgp-timestamp.tmp'
+    return 'pgp-timestamp-%s.tmp' % account['name']
+
+
+def sigfile_name(account):
+    """The last reply (committed)"""
+    if account['name'] == 'default':
+        return 'pgp-timestamp.sig'
+    return 'pgp-timestamp-%s.sig' % account['name']
+
+
+def sigfile_names():
+    return [sigfile_name(a) for a in accounts()]
+
+
+def receive_lock(account):
+    with serialize_create:
+        return receive_locks.setdefault(account['name'], threading.Lock())
+
+
+def mark_failed(account, reason):
+    """`account` could not deliver a request or reply; in `failover` mode,
+    the next account is used for the next request"""
+    failed[account['name']] = autoblockchainify.clock.time()
+    autoblockchainify.metrics.set('mail.%s.failed' % account['name'], True)
+    logging.warning("Mail account %s failed: %s", account['name'], reason)
+
+
+def recently_failed(account):
+    """Whether `account` has failed within the force interval"""
+    force = (autoblockchainify.config.arg.commit_interval
+             * autoblockchainify.config.arg.force_after_intervals)
+    return (failed.get(account['name'], float('-inf'))
+            + force.total_seconds() > autoblockchainify.clock.time())
 
 
 def split_host_port(host, default_port):
@@ -49,19 +99,28 @@ def split_host_port(host, default_port):
         return (host, default_port)
 
 
-def send(body, subject='Stamping request', to=None):
+def smtp_connection(host, port):
+    from smtplib import SMTP  # Only needed when mailing, speeds up startup
+    return SMTP(host, port=port)
+
+
+def imap_connection(host, port):
+    from imaplib import IMAP4  # Only needed when mailing, speeds up startup
+    return IMAP4(host=host, port=port)
+
+
+def send(body, account, subject='Stamping request', to=None):
     # Does not work in unittests if assigned in function header
     # (are bound too early? At load time instead of at call time?)
     if to is None:
-        to = autoblockchainify.config.arg.stamper_to
-    (host, port) = split_host_port(
-        autoblockchainify.config.arg.stamper_smtp_server, 587)
-    with SMTP(host, port=port) as smtp:
+        to = account['to']
+    (host, port) = split_host_port(account['smtp-server'], 587)
+    with smtp_connection(host, port) as smtp:
         smtp.starttls()
-        smtp.login(autoblockchainify.config.arg.stamper_username,
-                   autoblockchainify.config.arg.stamper_password)
-        frm = autoblockchainify.config.arg.stamper_own_address
-        date = strftime("%a, %d %b %Y %H:%M:%S +0000", gmtime())
+        smtp.login(account['username'], account['password'])
+        frm = account['own-address']
+        date = strftime("%a, %d %b %Y %H:%M:%S +0000",
+                        autoblockchainify.clock.gmtime())
         msg = """From: %s
 To: %s
 Date: %s
@@ -69,20 +128,21 @@ Subject: %s
 
 %s""" % (frm, to, date, subject, body)
         smtp.sendmail(frm, to, msg)
-        logging.complete("Timestamping request mailed")
+        logging.complete("Timestamping request mailed through %s",
+                         account['name'])
 
 
 def extract_pgp_body(body):
     try:
         body = str(body, 'ASCII')
     except TypeError as t:
-        logging.warning("Conversion error for message body: %s" % t)
+        logging.warning("Conversion error for message body: %s", t)
         return None
     lines = body.splitlines()
     start = None
     for i in range(0, len(lines)):
         if lines[i] == '-----BEGIN PGP SIGNED MESSAGE-----':
-            logging.debug("Found start at line %d: %s" % (i, lines[i]))
+            logging.debug("Found start at line %d: %s", i, lines[i])
             start = i
             break
     else:
@@ -91,7 +151,7 @@ def extract_pgp_body(body):
     end = None
     for i in range(start, len(lines)):
         if lines[i] == '-----END PGP SIGNATURE-----':
-            logging.debug("Found end at line %d: %s" % (i, lines[i]))
+            logging.debug("Found end at line %d: %s", i, lines[i])
             end = i
             break
     else:
@@ -99,14 +159,24 @@ def extract_pgp_body(body):
     return lines[start:end + 1]
 
 
-def save_signature(bodylines, logfile):
+def save_signature(bodylines, logfile, account):
     logging.xdebug("save_signature()")
     repo = autoblockchainify.config.arg.repository
-    ascfile = Path(repo, 'pgp-timestamp.sig')
+    ascfile = Path(repo, sigfile_name(account))
     with ascfile.open(mode='w') as f:
         f.write('\n'.join(bodylines) + '\n')
         # Change will be picked up by next check for directory modification
+    autoblockchainify.clock.touch(ascfile)
     logfile.unlink()  # Mark as reply received, no need for resumption
+    failed.pop(account['name'], None)
+    autoblockchainify.metrics.update({
+        'mail.%s.pending' % account['name']: False,
+        'mail.%s.received_time' % account['name']:
+            autoblockchainify.clock.time(),
+        'mail.%s.failed' % account['name']: False,
+    })
+    autoblockchainify.repository.context.changed(ascfile.name)
+    autoblockchainify.repository.context.changed(logfile.name)
 
 
 def maybe_decode(s):
@@ -117,7 +187,7 @@ def maybe_decode(s):
         return s.decode('ASCII')
 
 
-def body_signature_correct(bodylines, stat):
+def body_signature_correct(bodylines, stat, account):
     body = '\n'.join(bodylines)
     logging.debug("Bodylines", suffix=body)
     # Cannot use Python gnupg wrapper: Requires GPG 1.x to verify
@@ -134,39 +204,38 @@ def body_signature_correct(bodylines, stat):
     stderr = maybe_decode(res.stderr)
     logging.complete(stderr)
     if res.returncode != 0:
-        logging.error("gpg1 return code %d (%r)" % (res.returncode, stderr))
+        logging.error("gpg1 return code %d (%r)", res.returncode, stderr)
         return False
     if '\ngpg: Good signature' not in stderr:
-        logging.error("Missing good signature (%r)" % stderr)
+        logging.error("Missing good signature (%r)", stderr)
         return False
     if not stderr.startswith('gpg: Signature made '):
-        logging.error("No signature made (%r)" % stderr)
+        logging.error("No signature made (%r)", stderr)
         return False
-    if not ((' key ID %s\n' % autoblockchainify.config.arg.stamper_keyid)
+    if not ((' key ID %s\n' % account['keyid'])
             in stderr):
-        logging.error("Signature by wrong KeyID (%r)" % stderr)
+        logging.error("Signature by wrong KeyID (%r)", stderr)
         return False
     try:
         sigtime = datetime.strptime(stderr[24:48], "%b %d %H:%M:%S %Y %Z")
-        logging.xdebug("Extracted date %r" % sigtime)
+        logging.xdebug("Extracted date %r", sigtime)
     except ValueError:
-        logging.error("Illegal signature date format %r (%r)" %
-                      (stderr[24:48], stderr))
+        logging.error("Illegal signature date format %r (%r)",
+                      stderr[24:48], stderr)
         return False
-    if sigtime > datetime.utcnow() + timedelta(seconds=30):
-        logging.error("Signature time %s lies more than 30 seconds in the future"
-                      % sigtime)
+    if sigtime > autoblockchainify.clock.utcnow() + timedelta(seconds=30):
+        logging.error("Signature time %s lies more than 30 seconds in the future",
+                      sigtime)
         return False
     modtime = datetime.utcfromtimestamp(stat.st_mtime)
     if sigtime < modtime - timedelta(seconds=30):
         logging.error("Signature time %s is more than 30 seconds before "
-                      "file modification time %s"
-                      % (sigtime, modtime))
+                      "file modification time %s", sigtime, modtime)
         return False
     return True
 
 
-def verify_body_and_save_signature(body, stat, logfile, msgno):
+def verify_body_and_save_signature(body, stat, logfile, msgno, account):
     bodylines = extract_pgp_body(body)
     if bodylines is None:
         logging.error("No body lines")
@@ -174,22 +243,23 @@ def verify_body_and_save_signature(body, stat, logfile, msgno):
 
     res = body_contains_file(bodylines, logfile)
     if res is None:
-        logging.error("File contents not in message %s" % msgno)
+        logging.error("File contents not in message %s", msgno)
         return False
     else:
         (before, after) = res
-        logging.debug("Message wrapped in %d lines before, %d after" %
-                      (before, after))
+        logging.debug("Message wrapped in %d lines before, %d after",
+                      before, after)
         if before > 20 or after > 20:
             logging.error("Too many lines added by the PGP Timestamping Server"
-                          " before (%d)/after (%d) our contents" % (before, after))
+                          " before (%d)/after (%d) our contents",
+                          before, after)
             return False
 
-    if not body_signature_correct(bodylines, stat):
+    if not body_signature_correct(bodylines, stat, account):
         logging.error("Body signature incorrect")
         return False
 
-    save_signature(bodylines, logfile)
+    save_signature(bodylines, logfile, account)
     return True
 
 
@@ -232,120 +302,141 @@ def file_unchanged(stat, logfile):
         cur_stat = logfile.stat()
         unchanged = (cur_stat.st_mtime == stat.st_mtime
                      and cur_stat.st_ino == stat.st_ino)
-        logging.xdebug("%r unchanged: %r" % (logfile, unchanged))
+        logging.xdebug("%r unchanged: %r", logfile, unchanged)
         return unchanged
     except FileNotFoundError:
-        logging.xdebug("%r unchanged: missing" % logfile)
+        logging.xdebug("%r unchanged: missing", logfile)
         return False
 
 
-def imap_idle(imap, stat, logfile):
+def imap_idle(imap, stat, logfile, account):
+    """Wait for the reply with IMAP IDLE, until `REPLY_TIMEOUT` after the
+    request"""
+    deadline = stat.st_mtime + REPLY_TIMEOUT.total_seconds()
     while True:
+        remaining = deadline - autoblockchainify.clock.time()
+        if remaining <= 0:
+            logging.stop("No response received, giving up")
+            return False
+        # Also limits the wait for each IDLE notification below
+        imap.sock.settimeout(remaining)
         imap.send(b'%s IDLE\r\n' % (imap._new_tag()))
         logging.pause("IMAP idling")
         line = imap.readline().strip()
-        logging.debug("IMAP IDLE → %s" % line)
+        logging.debug("IMAP IDLE → %s", line)
         if line != b'+ idling':
             logging.error("IMAP IDLE unsuccessful")
             return False
         # Wait for new message
         while file_unchanged(stat, logfile):
-            line = imap.readline().strip()
+            try:
+                line = imap.readline().strip()
+            except socket.timeout:  # `TimeoutError` only from Python 3.10
+                logging.stop("No response received, giving up")
+                return False
             if line == b'' or line.startswith(b'* BYE '):
                 return False
             match = re.match(r'^\* ([0-9]+) EXISTS$', str(line, 'ASCII'))
             if match:
-                logging.success("You have new mail %s!"
-                                % match.group(1).encode('ASCII'))
+                logging.success("You have new mail %s!",
+                                match.group(1).encode('ASCII'))
                 # Stop idling
                 imap.send(b'DONE\r\n')
-                if check_for_stamper_mail(imap, stat, logfile) is True:
+                if check_for_stamper_mail(imap, stat, logfile,
+                                          account) is True:
                     logging.xdebug("Returning from success after idling")
                     return False
                 break  # Restart IDLE command
             # Otherwise: Uninteresting untagged response, continue idling
-        logging.stop("Next mail sent, giving up waiting on now-old reply")
+        else:
+            logging.stop("Next mail sent, giving up waiting on now-old reply")
+            return False
 
 
-def check_for_stamper_mail(imap, stat, logfile):
+def check_for_stamper_mail(imap, stat, logfile, account):
     # See `--no-dovecot-bug-workaround`:
-    query = ('FROM', '"%s"' % autoblockchainify.config.arg.stamper_from,
+    query = ('FROM', '"%s"' % account['from'],
              'UNSEEN',
              'LARGER', str(stat.st_size),
              'SMALLER', str(stat.st_size + 16384))
     logging.debug("IMAP SEARCH " + (' '.join(query)))
     (typ, msgs) = imap.search(None, *query)
-    logging.info("IMAP SEARCH → %s, %s" % (typ, msgs))
+    logging.info("IMAP SEARCH → %s, %s", typ, msgs)
     if len(msgs) == 1 and len(msgs[0]) > 0:
         mseq = msgs[0].replace(b' ', b',')
         (typ, contents) = imap.fetch(mseq, 'BODY[TEXT]')
-        logging.debug("IMAP FETCH → %s (%d)" % (typ, len(contents)))
+        logging.debug("IMAP FETCH → %s (%d)", typ, len(contents))
         remaining_msgids = mseq.split(b',')
         for m in contents:
             if m != b')':
                 msgid = remaining_msgids[0]
                 remaining_msgids = remaining_msgids[1:]
-                logging.debug("IMAP FETCH BODY (%s) → %s…" %
-                              (msgid, m[1][:20]))
-                if verify_body_and_save_signature(m[1], stat, logfile, msgid):
+                logging.debug("IMAP FETCH BODY (%s) → %s…",
+                              msgid, m[1][:20])
+                if verify_body_and_save_signature(m[1], stat, logfile, msgid,
+                                                  account):
                     logging.success(
-                        "Successful answer in message %s; deleting" % msgid)
+                        "Successful answer in message %s; deleting", msgid)
                     imap.store(msgid, '+FLAGS', '\\Deleted')
                     return True
     return False
 
 
-def wait_for_receive(logfile):
+def wait_for_receive(logfile, account):
+    stat = None
     try:
         logging.start("wait_for_receive", level=signale.XDEBUG,
-                      suffix="Threads: " + str(threading.enumerate()))
-        with serialize_receive:
+                      suffix=lambda: "Threads: " + str(threading.enumerate()))
+        with receive_lock(account):
             if not logfile.is_file():
                 logging.warning("Logfile vanished, should not happen")
                 return
             stat = logfile.stat()
-            logging.debug("Timestamp revision file is from %d" % stat.st_mtime)
-            (host, port) = split_host_port(
-                autoblockchainify.config.arg.stamper_imap_server, 143)
-            with IMAP4(host=host, port=port) as imap:
+            logging.debug("Timestamp revision file is from %d", stat.st_mtime)
+            (host, port) = split_host_port(account['imap-server'], 143)
+            with imap_connection(host, port) as imap:
                 imap.starttls()
-                imap.login(autoblockchainify.config.arg.stamper_username,
-                           autoblockchainify.config.arg.stamper_password)
+                imap.login(account['username'], account['password'])
                 imap.select('INBOX')
-                if not check_for_stamper_mail(imap, stat, logfile):
+                if not check_for_stamper_mail(imap, stat, logfile, account):
                     # No existing message found, wait for more incoming messages
                     # and process them until definitely okay or giving up for good
                     if 'IDLE' in imap.capabilities:
-                        imap_idle(imap, stat, logfile)
+                        imap_idle(imap, stat, logfile, account)
                     else:
                         logging.warning(
                             "IMAP server does not support IDLE; polling instead")
                         # Poll every minute, for 10 minutes;
                         # see description for `async_email_timestamp` below.
                         for _ in range(10):
-                            time.sleep(60)
-                            if check_for_stamper_mail(imap, stat, logfile):
+                            autoblockchainify.clock.sleep(60)
+                            if check_for_stamper_mail(imap, stat, logfile,
+                                                      account):
                                 logging.success("Polling found matching mail")
                                 return
                         logging.stop("No response received, giving up")
         logging.success("Returning from mail thread", level=signale.XDEBUG)
     except Exception:
         logging.exception("Unhandled exception in mail thread")
+    finally:
+        # Neither answered nor superseded by a newer request
+        if stat is not None and file_unchanged(stat, logfile):
+            mark_failed(account, "no reply to request of %s"
+                        % datetime.utcfromtimestamp(stat.st_mtime))
 
 
 def modified_in(file, wait):
-    """Has `logfile` not been modified in ~`wait` seconds?
-    Non-existent file is considered to *not* fulfill this."""
-    try:
-        stat = file.stat()
-        mtime = datetime.utcfromtimestamp(stat.st_mtime)
-        now = datetime.utcnow()
-        logging.xdebug("modified_in(%s, %s): mtime %s, now %s" %
-                       (file, wait, mtime, now))
-        return mtime + wait >= now
-    except FileNotFoundError:
-        logging.xdebug("modified_in: %s not found" % file)
+    """Has `file` (relative to the repository) been modified in the past
+    ~`wait` seconds? Non-existent file is considered to *not* fulfill this."""
+    stat = autoblockchainify.repository.context.stat(file)
+    if stat is None:
+        logging.xdebug("modified_in: %s not found", file)
         return False
+    mtime = datetime.utcfromtimestamp(stat.st_mtime)
+    now = autoblockchainify.clock.utcnow()
+    logging.xdebug("modified_in(%s, %s): mtime %s, now %s",
+                   file, wait, mtime, now)
+    return mtime + wait >= now
 
 
 # * `resume=True`: Run once at startup, to wait for a possibly pending
@@ -387,62 +478,160 @@ def modified_in(file, wait):
 #     past 4+5-epsilon minutes
 # Note: `wait` is almost 1 commit_interval shorter than forced_interval
 # (see `do_commit()`.)
-def needs_timestamp(log=False):
-    if not autoblockchainify.config.arg.stamper_own_address:
-        if log:
-            logging.debug("Timestamping by mail not configured")
-        return False
-    path = autoblockchainify.config.arg.repository
-    logfile = Path(path, 'pgp-timestamp.tmp')
-    sigfile = Path(path, 'pgp-timestamp.sig')
+def account_needs_timestamp(account, log=False):
+    logfile = logfile_name(account)
+    sigfile = sigfile_name(account)
     sigfile_interval = (autoblockchainify.config.arg.commit_interval
                         * autoblockchainify.config.arg.force_after_intervals
                         - timedelta(minutes=4))
-    if logfile.is_file() and modified_in(logfile, timedelta(minutes=4+5)):
+    if in_flight(account):
         if log:
-            logging.stop("Logfile more recent than 4+5 minutes, skipping")
+            logging.stop("Logfile %s more recent than 4+5 minutes, skipping",
+                         logfile)
         return False
-    if not sigfile.is_file() or not modified_in(sigfile, sigfile_interval):
+    if not modified_in(sigfile, sigfile_interval):
         return True
     else:
         if log:
-            logging.debug("Sigfile too fresh")
+            logging.debug("Sigfile %s too fresh", sigfile)
         return False
 
 
+def in_flight(account):
+    """Whether a request through `account` is waiting for its reply and
+    has not failed"""
+    logfile = logfile_name(account)
+    if not modified_in(logfile, REPLY_TIMEOUT):
+        return False
+    stat = autoblockchainify.repository.context.stat(logfile)
+    return failed.get(account['name'], float('-inf')) < stat.st_mtime
+
+
+def failover_order():
+    """Accounts in order of preference: those without recent failure first"""
+    return ([a for a in accounts() if not recently_failed(a)]
+            + [a for a in accounts() if recently_failed(a)])
+
+
+def requesting(log=False):
+    """The accounts through which to request a timestamp now.
+    `concurrent`: all which need one (see `account_needs_timestamp()`).
+    `failover`: the preferred account, unless a request is in flight or
+    any account's reply is fresh enough."""
+    if autoblockchainify.config.arg.stamper_mode == 'concurrent':
+        return [a for a in accounts() if account_needs_timestamp(a, log)]
+    if any(in_flight(a) for a in accounts()):
+        if log:
+            logging.stop("Request in flight, skipping")
+        return []
+    if not all(account_needs_timestamp(a, log) for a in accounts()):
+        return []
+    return failover_order()[:1]
+
+
+def needs_timestamp(log=False):
+    if not accounts():
+        if log:
+            logging.debug("Timestamping by mail not configured")
+        return False
+    return len(requesting(log)) > 0
+
+
+def request(account, head):
+    """Mail a request for `head` through `account` and wait for the reply
+    in a new thread. Returns `False` if the request could not be sent."""
+    path = autoblockchainify.config.arg.repository
+    logfile = Path(path, logfile_name(account))
+    if account['name'] != 'default':
+        exclude(path, 'pgp-timestamp-*.tmp')
+    new_rev = ("git commit %s\nTimestamp requested at %s\n" %
+               (head,
+                strftime("%Y-%m-%d %H:%M:%S UTC",
+                         autoblockchainify.clock.gmtime())))
+    logging.xdebug("Creating logfile with: %r", new_rev)
+    with serialize_create:
+        with logfile.open('w') as f:
+            f.write(new_rev)
+        autoblockchainify.clock.touch(logfile)
+        autoblockchainify.repository.context.changed(logfile.name)
+        try:
+            send(new_rev, account)
+        except OSError as e:  # Includes `smtplib.SMTPException`
+            logfile.unlink()
+            autoblockchainify.repository.context.changed(logfile.name)
+            mark_failed(account, e)
+            return False
+        autoblockchainify.metrics.update({
+            'mail.%s.pending' % account['name']: True,
+            'mail.%s.requested_time' % account['name']:
+                autoblockchainify.clock.time(),
+        })
+    listen(logfile, account, "mail")
+    return True
+
+
+def exclude(repo, pattern):
+    """Make sure `pattern` is ignored, even if `.gitignore` (in
+    repositories set up before multiple accounts) does not list it"""
+    path = Path(repo, '.git', 'info', 'exclude')
+    try:
+        patterns = path.read_text().splitlines()
+    except FileNotFoundError:
+        path.parent.mkdir(exist_ok=True)
+        patterns = []
+    if pattern not in patterns:
+        with path.open('a') as f:
+            f.write(pattern + '\n')
+
+
+def listen(logfile, account, name):
+    if account['name'] != 'default':
+        name += '-' + account['name']
+    threading.Thread(
+        target=autoblockchainify.log.in_cycle(wait_for_receive),
+        args=(logfile, account), name=name, daemon=True).start()
+
+
 def async_email_timestamp(resume=False):
     """If called with `resume=True`, tries to resume waiting for the mail"""
-    logging.xdebug("async_email_timestamp(%r)" % resume)
+    logging.xdebug("async_email_timestamp(%r)", resume)
     path = autoblockchainify.config.arg.repository
-    repo = git.Repository(path)
-    if repo.head_is_unborn:
-        logging.stop(
-            "Cannot timestamp by email yet: repository without commits")
-        return
-    head = repo.head
-    logfile = Path(path, 'pgp-timestamp.tmp')
     if resume:
-        if not logfile.is_file():
-            logging.stop("Not resuming mail timestamp: No pending mail reply")
-            return
-        with logfile.open() as f:
-            contents = f.read()
-        logging.xdebug("Resuming with logfile contents: %r" % contents)
-        if len(contents) < 40:
-            logging.stop("Not resuming mail timestamp: No revision info")
-            return
-        threading.Thread(target=wait_for_receive, args=(logfile,), name="mail_resume",
-                         daemon=True).start()
+        # A pending request implies a commit; do not load `pygit2` at startup
+        for account in accounts():
+            resume_receive(Path(path, logfile_name(account)), account)
     else:  # Fresh request
+        head = autoblockchainify.repository.context.head_hex()
+        if head is None:
+            logging.stop(
+                "Cannot timestamp by email yet: repository without commits")
+            return
         # No recent attempts or results for mail timestamping
-        if needs_timestamp(log=True):
-            new_rev = ("git commit %s\nTimestamp requested at %s\n" %
-                       (head.target.hex,
-                        strftime("%Y-%m-%d %H:%M:%S UTC", gmtime())))
-            logging.xdebug("Creating logfile with: %r" % new_rev)
-            with serialize_create:
-                with logfile.open('w') as f:
-                    f.write(new_rev)
-                send(new_rev)
-            threading.Thread(target=wait_for_receive, args=(logfile,), name="mail",
-                             daemon=True).start()
+        candidates = requesting(log=True)
+        if autoblockchainify.config.arg.stamper_mode == 'failover':
+            # Continue with the next account if sending fails
+            candidates = failover_order() if candidates else []
+            for account in candidates:
+                if request(account, head):
+                    break
+        else:
+            for account in candidates:
+                request(account, head)
+
+
+def resume_receive(logfile, account):
+    if not logfile.is_file():
+        logging.stop("Not resuming mail timestamp: No pending mail reply "
+                     "for %s", account['name'])
+        return
+    with logfile.open() as f:
+        contents = f.read()
+    logging.xdebug("Resuming with logfile contents: %r", contents)
+    if len(contents) < 40:
+        logging.stop("Not resuming mail timestamp: No revision info")
+        return
+    autoblockchainify.metrics.update({
+        'mail.%s.pending' % account['name']: True,
+        'mail.%s.requested_time' % account['name']: logfile.stat().st_mtime,
+    })
+    listen(logfile, account, "mail_resume")
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# In-memory metrics of the running daemon
+#
+# Names are dotted strings, e.g. `stage.files_per_second`; values are
+# numbers (or `None` if unknown). Metrics are updated by the commit cycle
+# and the mail threads and are never written to disk.
+
+import threading
+
+lock = threading.Lock()
+values = {}
+
+
+def set(name, value):
+    with lock:
+        values[name] = value
+
+
+def update(mapping):
+    """Set several metrics at once, consistently"""
+    with lock:
+        values.update(mapping)
+
+
+def inc(name, by=1):
+    with lock:
+        values[name] = values.get(name, 0) + by
+
+
+def get(name, default=None):
+    with lock:
+        return values.get(name, default)
+
+
+def snapshot():
+    """A consistent copy of all metrics"""
+    with lock:
+        return dict(values)
@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Export and verify the evidence for a single file's timestamp
+#
+# The bundle contains only the GIT objects on the path from the timestamps
+# to the file: The timestamp commits/tags, the timestamped commit, the trees
+# leading to the file and the file's blob, plus PGP Digital Timestamping
+# Service signatures naming the commit. Its size and the work to create it
+# depend on the depth of the file in the tree, not on the length of the
+# history. Timestamps and signatures naming the commit are looked up in the
+# content index (see `autoblockchainify.index`); without it, timestamps are
+# searched for on the timestamp branches and PGP signatures are left out.
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+import autoblockchainify.index
+
+FORMAT = 'autoblockchainify-proof-1'
+
+
+class ObjectReader:
+    """Reads raw objects through a single `git cat-file --batch`."""
+
+    def __init__(self, repo):
+        self.proc = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=repo,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def read(self, oid):
+        self.proc.stdin.write(oid.encode('ASCII') + b'\n')
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().decode('ASCII').split()
+        if len(header) != 3:
+            raise KeyError("Object %s: %s" % (oid, ' '.join(header)))
+        data = self.proc.stdout.read(int(header[2]))
+        self.proc.stdout.read(1)  # Newline
+        return (header[1], data)
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def object_id(kind, data, length):
+    """The GIT object ID of `data`, SHA-1 or SHA-256 depending on `length`
+    of the expected hex ID"""
+    h = hashlib.sha256() if length == 64 else hashlib.sha1()
+    h.update(b'%s %d\0' % (kind.encode('ASCII'), len(data)))
+    h.update(data)
+    return h.hexdigest()
+
+
+def tree_entries(data, oid_len):
+    """(mode, name, oid) for each entry of a raw tree object"""
+    i = 0
+    raw_len = oid_len // 2
+    while i < len(data):
+        space = data.index(b' ', i)
+        nul = data.index(b'\0', space)
+        yield (data[i:space].decode('ASCII'),
+               data[space + 1:nul].decode('UTF-8', 'surrogateescape'),
+               data[nul + 1:nul + 1 + raw_len].hex())
+        i = nul + 1 + raw_len
+
+
+def headers(data):
+    """Header fields of a commit or tag, as list of (key, value)"""
+    ret = []
+    for line in data.split(b'\n\n', 1)[0].split(b'\n'):
+        if line.startswith(b' ') and ret:
+            ret[-1] = (ret[-1][0], ret[-1][1] + b'\n' + line[1:])
+        else:
+            (key, _, value) = line.partition(b' ')
+            ret.append((key.decode('ASCII'), value))
+    return ret
+
+
+def use_index(repo):
+    """Whether there is a content index; if so, bring it up to date"""
+    if not autoblockchainify.index.index_path(repo).is_file():
+        return False
+    autoblockchainify.index.update(repo)
+    return True
+
+
+def find_commit(repo, path, when, indexed):
+    """The first commit which contained the version of `path` current at
+    `when` (seconds since the epoch); `None` if there was none"""
+    ret = subprocess.run(['git', 'rev-list', '-1', '--first-parent',
+                          '--before=@%d' % when, 'HEAD'],
+                         cwd=repo, capture_output=True, text=True, check=True)
+    at = ret.stdout.strip()
+    if not at:
+        return None
+    ret = subprocess.run(['git', 'rev-parse', '-q', '--verify',
+                          '%s:%s' % (at, path)],
+                         cwd=repo, capture_output=True, text=True)
+    if ret.returncode != 0:
+        return None  # Not (or no longer) there at that time
+    if indexed:
+        rows = autoblockchainify.index.lookup(repo, path, ret.stdout.strip())
+        if rows:
+            return rows[0][2]
+    # No index: The most recent commit changing `path` at that time
+    ret = subprocess.run(['git', 'rev-list', '-1', '--first-parent', at,
+                          '--', path],
+                         cwd=repo, capture_output=True, text=True, check=True)
+    return ret.stdout.strip()
+
+
+def timestamps(repo, commit, commit_time, indexed):
+    """Zeitgitter timestamp commits (on `*-timestamps` branches) and tags
+    directly referencing `commit`. Without the index, only the timestamps
+    newer than the commit are looked at, up to the first match per branch."""
+    if indexed:
+        found = autoblockchainify.index.timestamps(repo, commit)
+    else:
+        found = []
+        ret = subprocess.run(['git', 'for-each-ref', '--format=%(refname)',
+                              'refs/heads'],
+                             cwd=repo, capture_output=True, text=True,
+                             check=True)
+        for ref in ret.stdout.split():
+            if ref.endswith('-timestamps'):
+                found.extend(walk_timestamps(repo, ref, commit, commit_time))
+    ret = subprocess.run(['git', 'for-each-ref', '--format=%(objecttype) %(objectname)',
+                          '--points-at', commit, 'refs/tags'],
+                         cwd=repo, capture_output=True, text=True, check=True)
+    for line in ret.stdout.splitlines():
+        (kind, oid) = line.split()
+        if kind == 'tag':
+            found.append(oid)
+    return found
+
+
+def walk_timestamps(repo, ref, commit, commit_time):
+    """Timestamp commits on `ref` newer than `commit_time` which reference
+    `commit`, stopping at the first (i.e., most recent) one"""
+    proc = subprocess.Popen(['git', 'rev-list', '--first-parent', '--parents',
+                             '--since=@%d' % commit_time, ref],
+                            cwd=repo, stdout=subprocess.PIPE, text=True)
+    try:
+        for line in proc.stdout:
+            ids = line.split()
+            if commit in ids[1:]:
+                return [ids[0]]
+        return []
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+
+
+def pgp_signatures(repo, commit, indexed):
+    """Blob IDs of `pgp-timestamp.sig` (and `pgp-timestamp-<account>.sig`)
+    versions naming `commit`. Requires the content index."""
+    if not indexed:
+        print("WARNING: PGP signatures are only found with the content index"
+              " (`autoblockchainify-lookup --update`), leaving them out",
+              file=sys.stderr)
+        return []
+    return autoblockchainify.index.signatures(repo, commit)
+
+
+def export(repo, path, when):
+    """Create the evidence bundle (as dict) for `path` at `when`"""
+    indexed = use_index(repo)
+    commit = find_commit(repo, path, when, indexed)
+    if commit is None:
+        raise KeyError("No version of %s at that time" % path)
+    objects = {}
+    with ObjectReader(repo) as reader:
+        def add(oid):
+            (kind, data) = reader.read(oid)
+            objects[oid] = {'type': kind,
+                            'data': base64.b64encode(data).decode('ASCII')}
+            return data
+
+        data = add(commit)
+        fields = dict(headers(data))
+        commit_time = int(fields['committer'].split()[-2])
+        oid = fields['tree'].decode('ASCII')
+        for name in path.split('/'):
+            data = add(oid)
+            for (mode, entry, entry_oid) in tree_entries(data, len(oid)):
+                if entry == name:
+                    oid = entry_oid
+                    break
+            else:
+                raise KeyError("%s not in commit %s" % (path, commit))
+        add(oid)
+        evidence = timestamps(repo, commit, commit_time, indexed)
+        for ts in evidence:
+            add(ts)
+        pgp = []
+        for sig in pgp_signatures(repo, commit, indexed):
+            (kind, data) = reader.read(sig)
+            if re.search(rb'^git commit %s$' % commit.encode('ASCII'), data,
+                         re.MULTILINE):
+                add(sig)
+                pgp.append(sig)
+    return {'format': FORMAT, 'path': path, 'commit': commit, 'blob': oid,
+            'timestamps': evidence, 'pgp': pgp, 'objects': objects}
+
+
+def gpg_verify(signature, payload):
+    """Result of `gpg --verify` as text; `None` if gpg is unavailable"""
+    with tempfile.TemporaryDirectory() as tmp:
+        sigfile = Path(tmp, 'sig')
+        sigfile.write_bytes(signature)
+        args = [str(sigfile)]
+        if payload is not None:
+            Path(tmp, 'payload').write_bytes(payload)
+            args.append(str(Path(tmp, 'payload')))
+        try:
+            res = subprocess.run(['gpg', '--verify'] + args,
+                                 capture_output=True, text=True)
+        except FileNotFoundError:
+            return None
+    status = 'good' if res.returncode == 0 else 'BAD/UNKNOWN KEY'
+    return "%s: %s" % (status, res.stderr.strip().replace('\n', '; '))
+
+
+def verify(bundle, check_signatures=True):
+    """Verify `bundle`; returns a list of human-readable findings.
+    Raises `ValueError` if the bundle is inconsistent."""
+    if bundle.get('format') != FORMAT:
+        raise ValueError("Unknown bundle format")
+    objects = {}
+    for (oid, obj) in bundle['objects'].items():
+        data = base64.b64decode(obj['data'])
+        if object_id(obj['type'], data, len(oid)) != oid:
+            raise ValueError("Object %s does not match its ID" % oid)
+        objects[oid] = (obj['type'], data)
+    findings = []
+
+    # Commit → trees → blob
+    commit = bundle['commit']
+    (kind, data) = objects[commit]
+    fields = dict(headers(data))
+    oid = fields['tree'].decode('ASCII')
+    for name in bundle['path'].split('/'):
+        for (mode, entry, entry_oid) in tree_entries(objects[oid][1], len(oid)):
+            if entry == name:
+                oid = entry_oid
+                break
+        else:
+            raise ValueError("%s missing from tree" % bundle['path'])
+    if oid != bundle['blob'] or objects[oid][0] != 'blob':
+        raise ValueError("Tree does not lead to the file contents")
+    findings.append("%s (blob %s) is part of commit %s, committed %s"
+                    % (bundle['path'], oid, commit,
+                       fields['committer'].decode('UTF-8')))
+
+    # Timestamps → commit
+    for ts in bundle['timestamps']:
+        (kind, data) = objects[ts]
+        ts_fields = headers(data)
+        signature = payload = None
+        if kind == 'commit':
+            if (('parent', commit.encode('ASCII')) not in ts_fields):
+                raise ValueError("Timestamp %s does not reference commit" % ts)
+            sig = [v for (k, v) in ts_fields if k == 'gpgsig']
+            if sig:
+                signature = sig[0] + b'\n'
+                # Signed payload is the commit without the signature header
+                payload = re.sub(rb'\ngpgsig [^\n]*(\n [^\n]*)*', b'', data,
+                                 count=1)
+        else:
+            if ('object', commit.encode('ASCII')) not in ts_fields:
+                raise ValueError("Timestamp %s does not reference commit" % ts)
+            start = data.find(b'-----BEGIN PGP SIGNATURE-----')
+            if start >= 0:
+                (payload, signature) = (data[:start], data[start:])
+        who = dict(ts_fields).get('committer', dict(ts_fields).get('tagger', b''))
+        result = "unsigned"
+        if signature is not None and check_signatures:
+            result = gpg_verify(signature, payload) or "gpg not available"
+        findings.append("Timestamp %s by %s: %s"
+                        % (ts, who.decode('UTF-8'), result))
+
+    # PGP Digital Timestamping Service signatures
+    for sig in bundle['pgp']:
+        (kind, data) = objects[sig]
+        if not re.search(rb'^git commit %s$' % commit.encode('ASCII'), data,
+                         re.MULTILINE):
+            raise ValueError("PGP signature %s does not name commit" % sig)
+        result = "not checked"
+        if check_signatures:
+            result = gpg_verify(data, None) or "gpg not available"
+        findings.append("PGP Digital Timestamping Service %s: %s"
+                        % (sig, result))
+    if not bundle['timestamps'] and not bundle['pgp']:
+        findings.append("WARNING: No timestamp references this commit")
+    return findings
+
+
+def parse_when(s):
+    if s is None:
+        return int(datetime.now(timezone.utc).timestamp())
+    if s.isdigit():
+        return int(s)
+    when = datetime.fromisoformat(s)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return int(when.timestamp())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="""Export a self-contained evidence bundle for a file's
+            timestamp, or verify such a bundle offline.""")
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help="create an evidence bundle")
+    exp.add_argument('--repository',
+                     default='.',
+                     help="path to the GIT repository")
+    exp.add_argument('--at',
+                     help="""point in time (ISO 8601, UTC unless specified, or
+                        seconds since the epoch); default: now""")
+    exp.add_argument('--output', '-o',
+                     help="bundle file to write (default: stdout)")
+    exp.add_argument('path',
+                     help="path of the file, relative to the repository")
+    ver = sub.add_parser('verify', help="verify an evidence bundle")
+    ver.add_argument('--no-signatures', action='store_true',
+                     help="only verify the hash chain, not the signatures")
+    ver.add_argument('--extract',
+                     help="write the file contents from the bundle here")
+    ver.add_argument('bundle', help="bundle file to verify")
+    arg = parser.parse_args(args)
+
+    if arg.command == 'export':
+        try:
+            bundle = export(arg.repository, arg.path, parse_when(arg.at))
+        except KeyError as e:
+            sys.exit(str(e))
+        if arg.output is None:
+            json.dump(bundle, sys.stdout, indent=1)
+        else:
+            with open(arg.output, 'w') as f:
+                json.dump(bundle, f, indent=1)
+        return 0
+    else:
+        with open(arg.bundle) as f:
+            bundle = json.load(f)
+        try:
+            findings = verify(bundle, not arg.no_signatures)
+        except (ValueError, KeyError) as e:
+            sys.exit("Verification FAILED: %s" % e)
+        for finding in findings:
+            print(finding)
+        if arg.extract:
+            Path(arg.extract).write_bytes(
+                base64.b64decode(bundle['objects'][bundle['blob']]['data']))
+        return 0
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Pushing only the branches which have changed since the last push
+#
+# The commit ID of every branch successfully pushed to a remote (by URL, so
+# changing what a remote name points to starts afresh) is recorded in
+# `.git/autoblockchainify-pushed.json`. A push then only names the
+# branches whose commit differs from the recorded one, and is skipped
+# entirely if there are none. If a push fails, the record for that remote is
+# dropped, so the next push will again offer all branches.
+#
+# SSH connections are kept open between commit cycles (OpenSSH
+# `ControlMaster`), unless disabled or `GIT_SSH`/`GIT_SSH_COMMAND`/
+# `core.sshCommand` are set.
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+from pathlib import Path
+
+import autoblockchainify.config
+import autoblockchainify.log
+
+logging = autoblockchainify.log.Logger("commit")
+
+# remote URL → {refname: commit ID} as last pushed; loaded on first use
+pushed = None
+
+
+def cache_path(repo):
+    return Path(repo, '.git', 'autoblockchainify-pushed.json')
+
+
+def load(repo):
+    global pushed
+    if pushed is None:
+        try:
+            with cache_path(repo).open() as f:
+                pushed = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pushed = {}
+    return pushed
+
+
+def save(repo):
+    tmp = cache_path(repo).with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(pushed, f)
+    os.replace(tmp, cache_path(repo))
+
+
+def redacted(to):
+    """`to` without any credentials in the URL (`https://user:token@…`),
+    for metrics and log messages"""
+    return re.sub(r'^([A-Za-z][-+.\w]*://)[^/@]*@', r'\1', to)
+
+
+def resolved(repo, to):
+    """The URL of `to`, which may also be a remote name"""
+    return subprocess.run(['git', 'ls-remote', '--get-url', to], cwd=repo,
+                          capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def local_branches(repo):
+    """{refname: commit ID} for all local branches"""
+    ret = subprocess.run(['git', 'for-each-ref',
+                          '--format=%(objectname) %(refname)', 'refs/heads/'],
+                         cwd=repo, capture_output=True, text=True, check=True)
+    refs = {}
+    for line in ret.stdout.splitlines():
+        (oid, ref) = line.split(' ', 1)
+        refs[ref] = oid
+    return refs
+
+
+def selected(refs, branches):
+    """The subset of `refs` named by `--push-branch`, or `None` if it cannot
+    be mapped to local branches (e.g., it contains refspecs)"""
+    if branches == ['--all']:
+        return refs
+    result = {}
+    for b in branches:
+        ref = b if b.startswith('refs/heads/') else 'refs/heads/' + b
+        if ref not in refs:
+            return None
+        result[ref] = refs[ref]
+    return result
+
+
+def ssh_environment(repo):
+    """Environment for `git push`, sharing SSH connections across pushes;
+    `None` to leave the user's SSH configuration alone"""
+    env = os.environ.copy()
+    if (autoblockchainify.config.arg.no_ssh_multiplexing
+            or 'GIT_SSH' in env or 'GIT_SSH_COMMAND' in env):
+        return None
+    if subprocess.run(['git', 'config', '--get', 'core.sshCommand'],
+                      cwd=repo, capture_output=True).returncode == 0:
+        return None
+    # Outlive the pause until the next commit cycle
+    persist = int(autoblockchainify.config.arg.commit_interval
+                  .total_seconds()) + 60
+    control = os.path.join(tempfile.gettempdir(), 'autoblockchainify-ssh-%C')
+    env['GIT_SSH_COMMAND'] = ('ssh -o ControlMaster=auto -o ControlPath=%s '
+                              '-o ControlPersist=%d' % (control, persist))
+    return env
+
+
+def push(repo, to, branches):
+    """Push those of `branches` which have changed since the last
+    successful push to `to`"""
+    load(repo)
+    url = resolved(repo, to)
+    refs = selected(local_branches(repo), branches)
+    if refs is None:
+        # Not all plain branch names; cannot track, push as requested
+        args = branches
+        refs = {}
+    else:
+        last = pushed.get(url, {})
+        refs = {ref: oid for (ref, oid) in refs.items()
+                if last.get(ref) != oid}
+        if not refs:
+            logging.info("%s is up to date", redacted(to))
+            return True
+        args = [ref + ':' + ref for ref in sorted(refs)]
+    logging.pending("Pushing to %s", ['git', 'push', redacted(to)] + args)
+    ret = subprocess.run(['git', 'push', to] + args,
+                         cwd=repo, env=ssh_environment(repo))
+    if ret.returncode != 0:
+        logging.error("'git push %s %s' failed", redacted(to), ' '.join(args))
+        if pushed.pop(url, None) is not None:
+            save(repo)
+        return False
+    if refs:
+        pushed.setdefault(url, {}).update(refs)
+        save(repo)
+    return True
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Long-lived repository state, shared across commit cycles
+
+import threading
+from pathlib import Path
+
+import autoblockchainify.log
+
+logging = autoblockchainify.log.Logger("commit")
+
+# The context for `--repository`, set up by `daemon.run()`
+context = None
+
+
+class Context:
+    """Caches the opened repository, the HEAD commit and the `stat()`
+    results of files in the working directory across commit cycles.
+
+    Changes made by the daemon itself are announced through `changed_head()`
+    and `changed()`. Changes to HEAD made by others (e.g., a manual merge)
+    are noticed through the reflog, which is the only file checked on
+    every access. Files are assumed to be modified by the daemon only."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.reflog = Path(path, '.git', 'logs', 'HEAD')
+        self._repo = None
+        self._head = None  # (reflog key, commit ID hex, commit time)
+        self._stats = {}
+
+    def repository(self):
+        with self.lock:
+            if self._repo is None:
+                # Loaded on first use only, to speed up startup
+                import pygit2
+                self._repo = pygit2.Repository(self.path)
+            return self._repo
+
+    def _reflog_key(self):
+        try:
+            st = self.reflog.stat()
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _current_head(self):
+        with self.lock:
+            key = self._reflog_key()
+            if self._head is None or key is None or self._head[0] != key:
+                r = self.repository()
+                if r.head_is_unborn:
+                    self._head = (key, None, None)
+                else:
+                    commit = r.head.peel()
+                    self._head = (key, str(commit.id), commit.commit_time)
+                logging.xdebug("HEAD is %s", self._head[1])
+            return self._head
+
+    def head_hex(self):
+        """Commit ID of HEAD as hex string, or `None` for an unborn HEAD."""
+        return self._current_head()[1]
+
+    def head_time(self):
+        """Commit time of HEAD (seconds since the epoch), or `None` for an
+        unborn HEAD."""
+        return self._current_head()[2]
+
+    def changed_head(self):
+        with self.lock:
+            self._head = None
+
+    def stat(self, name):
+        """Cached `stat()` result for `name` (relative to the working
+        directory), or `None` if it does not exist."""
+        with self.lock:
+            if name not in self._stats:
+                try:
+                    self._stats[name] = Path(self.path, name).stat()
+                except FileNotFoundError:
+                    self._stats[name] = None
+            return self._stats[name]
+
+    def changed(self, name=None):
+        """`name` has been modified; `None` invalidates all files."""
+        with self.lock:
+            if name is None:
+                self._stats.clear()
+            else:
+                self._stats.pop(name, None)
+
+
+def open_context(path):
+    global context
+    context = Context(path)
+    return context
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Sealing files which have not been modified for `--seal-after`
+#
+# Sealed files are marked `skip-worktree` in the index, so `git status` and
+# `git add` no longer look at them. Instead, their `stat()` information is
+# recorded in a manifest. A slice of the manifest is compared against the
+# file system on every commit cycle, such that every sealed file is checked
+# once per force interval. A sealed file which has been modified or removed
+# is reported as an integrity alert and unsealed, so the change will be
+# committed (and timestamped) by the next cycle. Files no longer in the index
+# (e.g., moved into a shard by `--shard-subdirectories`) are dropped from the
+# manifest at the start of every round.
+
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+from stat import S_ISDIR
+
+import autoblockchainify.config
+import autoblockchainify.log
+
+logging = autoblockchainify.log.Logger("seal")
+
+# path → [size, mtime_ns, inode] of sealed files; loaded on first use
+manifest = None
+# Where the next integrity check slice starts
+check_position = 0
+
+
+def manifest_path(repo):
+    return Path(repo, '.git', 'autoblockchainify-sealed.json')
+
+
+def load(repo):
+    global manifest
+    if manifest is None:
+        try:
+            with manifest_path(repo).open() as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+    return manifest
+
+
+def save(repo):
+    tmp = manifest_path(repo).with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_path(repo))
+
+
+def fingerprint(stat):
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def update_index(repo, flag, paths):
+    subprocess.run(['git', 'update-index', '-z', flag, '--stdin'], cwd=repo,
+                   input=b''.join(p.encode('UTF-8', 'surrogateescape') + b'\0'
+                                  for p in paths),
+                   check=True)
+
+
+def seal(repo):
+    """Seal all committed files not modified for `--seal-after`.
+    To be called right after a commit, when the index matches the files."""
+    load(repo)
+    limit = time.time() - autoblockchainify.config.arg.seal_after.total_seconds()
+    ret = subprocess.run(['git', 'ls-files', '-z', '-v'], cwd=repo,
+                         capture_output=True, check=True)
+    sealing = {}
+    for entry in ret.stdout.split(b'\0'):
+        # Tag `H` is a normal tracked file, `S` is skip-worktree
+        if not entry.startswith(b'H '):
+            continue
+        path = entry[2:].decode('UTF-8', 'surrogateescape')
+        if path.startswith('pgp-timestamp') and path.endswith('.sig'):
+            continue  # Regularly updated by us
+        try:
+            stat = Path(repo, path).lstat()
+        except FileNotFoundError:
+            continue
+        if S_ISDIR(stat.st_mode):
+            continue  # A shard (`--shard-subdirectories`), changes inside
+        if stat.st_mtime < limit:
+            sealing[path] = fingerprint(stat)
+    if sealing:
+        update_index(repo, '--skip-worktree', sealing.keys())
+        manifest.update(sealing)
+        save(repo)
+        logging.info("Sealed %d file(s), %d sealed in total",
+                     len(sealing), len(manifest))
+
+
+def prune(repo):
+    """Drop the manifest entries of files no longer in the index"""
+    ret = subprocess.run(['git', 'ls-files', '-z'], cwd=repo,
+                         capture_output=True, check=True)
+    tracked = set(ret.stdout.decode('UTF-8', 'surrogateescape').split('\0'))
+    gone = [path for path in manifest if path not in tracked]
+    if gone:
+        for path in gone:
+            del manifest[path]
+        save(repo)
+        logging.info("Dropped %d file(s) no longer in the index from the "
+                     "manifest", len(gone))
+
+
+def check(repo):
+    """Check the next slice of sealed files against the manifest; unseal
+    and report any which have changed."""
+    global check_position
+    load(repo)
+    if manifest and check_position == 0:
+        prune(repo)
+    if not manifest:
+        return
+    paths = list(manifest.keys())
+    count = -(-len(paths) // autoblockchainify.config.arg.force_after_intervals)
+    changed = []
+    for path in paths[check_position:check_position + count]:
+        try:
+            unchanged = (fingerprint(Path(repo, path).lstat())
+                         == manifest[path])
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            changed.append(path)
+    check_position += count
+    if check_position >= len(paths):
+        check_position = 0
+    if changed:
+        prune(repo)  # Removed from the index since the start of the round
+        changed = [path for path in changed if path in manifest]
+    if changed:
+        for path in changed:
+            logging.error("Integrity alert: sealed file %s has been "
+                          "modified or removed", path)
+        update_index(repo, '--no-skip-worktree', changed)
+        for path in changed:
+            del manifest[path]
+        save(repo)
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Sharding very large trees by top-level subdirectory
+#
+# With `--shard-subdirectories`, every top-level subdirectory (except
+# dot-directories) becomes a git repository of its own, a *shard*. Shards
+# with changes are committed in parallel at the start of a commit cycle.
+# The repository itself (the *superproject*) then records the HEAD of each
+# shard as a gitlink, together with the top-level files; only superproject
+# commits are timestamped and pushed. As a gitlink is the commit ID of the
+# shard, which is a hash over its entire history, timestamping the
+# superproject also timestamps the shards.
+#
+# A subdirectory already tracked by the superproject is converted into a
+# shard: its current contents are committed to the new shard and replaced
+# by a gitlink in the superproject (the old history remains in the
+# superproject).
+#
+# Directories ignored by `.gitignore` (or `.git/info/exclude`) are not
+# sharded. When pushing, the commit of each shard recorded in HEAD is pushed
+# to the same repository as `refs/shards/<name>`, so the gitlinks can be
+# resolved there (`git fetch <repo> 'refs/shards/*:refs/shards/*'`).
+
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import autoblockchainify.config
+import autoblockchainify.log
+import autoblockchainify.metrics
+import autoblockchainify.push
+import autoblockchainify.throttle
+
+logging = autoblockchainify.log.Logger("shard")
+
+
+def shard_dirs(repo):
+    """Names of the top-level subdirectories to be sharded, i.e., neither
+    dot-directories nor ignored"""
+    names = sorted(entry.name for entry in os.scandir(repo)
+                   if entry.is_dir(follow_symlinks=False)
+                   and not entry.name.startswith('.'))
+    if not names:
+        return names
+    ret = subprocess.run(['git', 'check-ignore', '-z', '--stdin'], cwd=repo,
+                         input=b''.join(name.encode('UTF-8', 'surrogateescape')
+                                        + b'/\0' for name in names),
+                         capture_output=True)
+    if ret.returncode > 1:  # 1: None ignored
+        raise subprocess.CalledProcessError(ret.returncode, ret.args,
+                                            ret.stdout, ret.stderr)
+    ignored = {path.decode('UTF-8', 'surrogateescape').rstrip('/')
+               for path in ret.stdout.split(b'\0') if path}
+    return [name for name in names if name not in ignored]
+
+
+def git(path, *args, **kwargs):
+    return autoblockchainify.throttle.run(['git'] + list(args),
+                                          cwd=path, **kwargs)
+
+
+def is_shard(path):
+    return Path(path, '.git').exists()
+
+
+def identity(repo):
+    """`-c` options passing on the superproject's user name/email"""
+    options = []
+    for key in ('user.name', 'user.email'):
+        ret = subprocess.run(['git', 'config', '--get', key], cwd=repo,
+                             capture_output=True, text=True)
+        if ret.returncode == 0:
+            options += ['-c', key + '=' + ret.stdout.strip()]
+    return options
+
+
+def tracked_as_tree(repo, name):
+    """Whether the superproject tracks `name` as a directory (pre-sharding)"""
+    ret = git(repo, 'ls-files', '-s', '--', name + '/',
+              capture_output=True, check=True)
+    return ret.stdout != b'' and not ret.stdout.startswith(b'160000 ')
+
+
+def commit_shard(path, message, options):
+    """Commit all changes in the shard at `path`; returns whether
+    a commit has been made"""
+    if not is_shard(path):
+        if not any(os.scandir(path)):
+            return False  # Empty, would result in an unborn shard
+        logging.info("Creating shard %s", path)
+        git(path, 'init', '--quiet', check=True)
+    ret = git(path, 'status', '-z', capture_output=True, check=True)
+    if ret.stdout == b'':
+        return False
+    git(path, 'add', '.', check=True)
+    git(path, *options, 'commit', '--quiet', '-m', message, check=True)
+    return True
+
+
+def commit_shards(repo):
+    """Commit the changes in all shards, in parallel; the superproject
+    will then see the shards with new commits as modified"""
+    start = time.monotonic()
+    names = shard_dirs(repo)
+    nowstr = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+    message = "🔗 Autoblockchainify data as of " + nowstr
+    options = identity(repo)
+    workers = autoblockchainify.config.arg.shard_workers or os.cpu_count()
+
+    def work(name):
+        try:
+            return commit_shard(Path(repo, name), message, options)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logging.error("Committing shard %s failed: %s", name, e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix='shard') as pool:
+        results = list(pool.map(autoblockchainify.log.in_cycle(work), names))
+    committed = [name for (name, result) in zip(names, results) if result]
+    # Convert directories previously tracked by the superproject
+    for name in committed:
+        if tracked_as_tree(repo, name):
+            logging.info("Converting %s into a shard", name)
+            git(repo, 'rm', '-r', '--cached', '--quiet', '--', name,
+                check=True)
+    elapsed = time.monotonic() - start
+    autoblockchainify.metrics.update({
+        'shards.count': len(names),
+        'shards.committed': len(committed),
+        'shards.seconds': elapsed,
+    })
+    if committed:
+        logging.info("Committed %d of %d shard(s) in %.1fs",
+                     len(committed), len(names), elapsed)
+    return committed
+
+
+def committed_shards(repo):
+    """{name: commit ID} of the shards as recorded in HEAD"""
+    ret = git(repo, 'ls-tree', '-z', 'HEAD', capture_output=True, check=True)
+    shards = {}
+    for entry in ret.stdout.split(b'\0'):
+        if entry.startswith(b'160000 '):
+            (info, name) = entry.split(b'\t', 1)
+            shards[name.decode('UTF-8', 'surrogateescape')] = \
+                info.split()[2].decode()
+    return shards
+
+
+def push(repo, to):
+    """Push the shard commits recorded in HEAD to `to` as
+    `refs/shards/<name>`, skipping those pushed there before"""
+    # Resolve the superproject's remote names; relative paths still apply,
+    # as the shards are pushed from the superproject's directory
+    url = autoblockchainify.push.resolved(repo, to)
+    pushed = autoblockchainify.push.load(repo).setdefault(url, {})
+    refs = {'refs/shards/' + name: oid
+            for (name, oid) in committed_shards(repo).items()
+            if pushed.get('refs/shards/' + name) != oid}
+    if not refs:
+        return True
+    env = autoblockchainify.push.ssh_environment(repo)
+    success = True
+    for (ref, oid) in sorted(refs.items()):
+        name = ref[len('refs/shards/'):]
+        ret = subprocess.run(['git', '--git-dir', os.path.join(name, '.git'),
+                              'push', url, oid + ':' + ref],
+                             cwd=repo, env=env)
+        if ret.returncode != 0:
+            logging.error("Pushing shard %s to %s failed",
+                          name, autoblockchainify.push.redacted(to))
+            pushed.pop(ref, None)
+            success = False
+        else:
+            pushed[ref] = oid
+    autoblockchainify.push.save(repo)
+    logging.info("Pushed %d shard(s) to %s",
+                 len(refs), autoblockchainify.push.redacted(to))
+    return success
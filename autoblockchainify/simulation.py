@@ -0,0 +1,500 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Simulated daemon operation, for testing the scheduling logic
+#
+# `python3 -m autoblockchainify.simulation --days 3` runs the unmodified
+# `commit.loop()` in a temporary directory against a virtual clock, so days
+# of operation take seconds. Stand-ins replace the outside world:
+# * Zeitgitter servers: timestamp commits are created locally, on the
+#   `<server>-timestamps` branches, like `git timestamp` does;
+# * the PGP Digital Timestamping Service: an in-process SMTP server accepts
+#   requests, which are answered on the next full 5 minutes (plus delivery
+#   delay) to an in-process IMAP mailbox, with a fake signature;
+# * push repositories: local bare repositories.
+# Git commit dates and the modification times of the mail files follow the
+# virtual clock. Files are written according to a random (`--seed`)
+# workload. Afterwards, the history is checked against the guarantees of the
+# daemon; violations are printed and result in exit code 1. Any further
+# arguments are passed on to the daemon (e.g. `--commit-interval 5m`).
+
+import argparse
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import autoblockchainify.clock
+import autoblockchainify.commit
+import autoblockchainify.config
+import autoblockchainify.daemon
+import autoblockchainify.log
+import autoblockchainify.mail
+import autoblockchainify.repository
+import autoblockchainify.shard
+
+logging = autoblockchainify.log.Logger("simulation")
+
+FAKE_SIGNATURE = 'Simulated signature'
+
+
+class VirtualClock(autoblockchainify.clock.Clock):
+    """A clock which only advances when all participating threads wait.
+
+    Participating threads are those whose names start with one of
+    `participants` (the commit and mail threads). Whenever the thread
+    driving the simulation (running `commit.loop()`) waits, the clock jumps
+    to the earliest of its timeout, the end of any sleep, or a scheduled
+    event (`at()`), but only after all participating threads are sleeping
+    or have finished."""
+
+    participants = ('commit', 'mail', 'shard')
+
+    def __init__(self, start):
+        self.now = start
+        self.cond = threading.Condition()
+        self.sleepers = {}  # thread → wakeup time
+        self.events = []  # [(time, sequence, function)]
+        self.sequence = 0
+        self.stalls = 0
+        self.set_git_dates()
+
+    def set_git_dates(self):
+        date = '@%d +0000' % self.now
+        os.environ['GIT_AUTHOR_DATE'] = date
+        os.environ['GIT_COMMITTER_DATE'] = date
+
+    def time(self):
+        with self.cond:
+            return self.now
+
+    def at(self, when, function):
+        """Call `function()` (from the driving thread) at virtual `when`"""
+        with self.cond:
+            self.events.append((when, self.sequence, function))
+            self.sequence += 1
+            self.events.sort(key=lambda e: e[:2])
+
+    def sleep(self, seconds):
+        me = threading.current_thread()
+        with self.cond:
+            wakeup = self.now + seconds
+            self.sleepers[me] = wakeup
+            while self.now < wakeup:
+                self.cond.wait()
+            self.sleepers.pop(me, None)
+
+    def quiesce(self, patience=2.0):
+        """Wait (in real time) until all participating threads sleep or
+        have finished. After `patience` seconds without that happening
+        (e.g., a thread waits for a lock held by a sleeper), continue."""
+        deadline = time.monotonic() + patience
+        me = threading.current_thread()
+        while True:
+            with self.cond:
+                busy = [t for t in threading.enumerate()
+                        if t is not me and t.name.startswith(self.participants)
+                        and t not in self.sleepers]
+            if not busy:
+                return
+            if time.monotonic() > deadline:
+                logging.warning("Threads %s not waiting, advancing anyway",
+                                busy)
+                self.stalls += 1
+                return
+            time.sleep(0.001)
+
+    def wait(self, event, timeout):
+        deadline = self.now + timeout
+        while True:
+            self.quiesce()
+            if event.is_set():
+                return True
+            with self.cond:
+                candidates = [deadline] + list(self.sleepers.values())
+                if self.events:
+                    candidates.append(self.events[0][0])
+                self.now = max(self.now, min(candidates))
+                self.set_git_dates()
+                # Runnable again as of now, even if not scheduled yet
+                for (thread, wakeup) in list(self.sleepers.items()):
+                    if wakeup <= self.now:
+                        del self.sleepers[thread]
+                due = []
+                while self.events and self.events[0][0] <= self.now:
+                    due.append(self.events.pop(0)[2])
+                self.cond.notify_all()
+            for function in due:
+                function()
+            if event.is_set():
+                return True
+            if self.now >= deadline:
+                return False
+
+    def touch(self, path):
+        os.utime(path, (self.now, self.now))
+
+
+class Stamper:
+    """The PGP Digital Timestamping Service, answering on every full
+    5 minutes, `delay` seconds later"""
+
+    def __init__(self, clock, mailbox, delay=60):
+        self.clock = clock
+        self.mailbox = mailbox
+        self.delay = delay
+        self.requests = []  # Virtual times
+        self.hosts = []  # SMTP server of each request
+
+    def receive(self, msg, host):
+        now = self.clock.time()
+        self.requests.append(now)
+        self.hosts.append(host)
+        body = msg.split('\n\n', 1)[1]
+        reply = '\n'.join(['-----BEGIN PGP SIGNED MESSAGE-----', '',
+                           body.rstrip('\n'), '',
+                           '-----BEGIN PGP SIGNATURE-----', '',
+                           FAKE_SIGNATURE, '',
+                           '-----END PGP SIGNATURE-----', ''])
+        answer = now - (now % 300) + 300 + self.delay
+        self.clock.at(answer, lambda: self.mailbox.append(
+            reply.encode('ASCII')))
+
+
+class FakeSMTP:
+    """Stand-in for `smtplib.SMTP`, delivering to `stamper`; connecting to
+    a host in `unreachable` fails"""
+    stamper = None
+    unreachable = set()
+
+    def __init__(self, host):
+        if host in self.unreachable:
+            raise ConnectionRefusedError("Simulated: %s unreachable" % host)
+        self.host = host
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, frm, to, msg):
+        self.stamper.receive(msg, self.host)
+
+
+class FakeIMAP:
+    """Stand-in for `imaplib.IMAP4` without IDLE, on `mailbox`"""
+    mailbox = None
+    lock = threading.Lock()
+    capabilities = ('IMAP4REV1',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def select(self, mailbox):
+        pass
+
+    def search(self, charset, *query):
+        with self.lock:
+            # Seen (fetched) messages are replaced by `None`
+            ids = [str(i + 1).encode('ASCII')
+                   for (i, m) in enumerate(self.mailbox) if m is not None]
+        return ('OK', [b' '.join(ids)])
+
+    def fetch(self, mseq, parts):
+        contents = []
+        with self.lock:
+            for msgid in mseq.split(b','):
+                i = int(msgid) - 1
+                body = self.mailbox[i]
+                self.mailbox[i] = None
+                contents.append((msgid + b' (BODY[TEXT] {%d}' % len(body),
+                                 body))
+                contents.append(b')')
+        return ('OK', contents)
+
+    def store(self, msgid, command, flags):
+        return ('OK', [])
+
+
+def fake_signature_correct(bodylines, stat, account):
+    return FAKE_SIGNATURE in bodylines
+
+
+def fake_cross_timestamp(repo, options, server):
+    """Create a timestamp commit for HEAD, like `git timestamp`"""
+    if '--branch' in options:
+        branch = options[options.index('--branch') + 1]
+    else:
+        branch = re.sub(r'^https?://|[.:/].*$', '', server) + '-timestamps'
+    tree = subprocess.run(['git', 'mktree'], cwd=repo, input=b'',
+                          capture_output=True, check=True).stdout.strip()
+    parents = ['-p', 'HEAD']
+    if subprocess.run(['git', 'rev-parse', '--verify', '--quiet',
+                       'refs/heads/' + branch], cwd=repo,
+                      capture_output=True).returncode == 0:
+        parents = ['-p', 'refs/heads/' + branch] + parents
+    commit = subprocess.run(['git', 'commit-tree', tree.decode()] + parents
+                            + ['-m', 'Simulated timestamp by ' + server],
+                            cwd=repo, capture_output=True, text=True,
+                            check=True).stdout.strip()
+    subprocess.run(['git', 'update-ref', 'refs/heads/' + branch, commit],
+                   cwd=repo, check=True)
+    return True
+
+
+def install(clock, mailbox):
+    """Replace the outside world by the stand-ins"""
+    autoblockchainify.clock.install(clock)
+    FakeSMTP.stamper = Stamper(clock, mailbox)
+    FakeIMAP.mailbox = mailbox
+    autoblockchainify.mail.smtp_connection = lambda host, port: FakeSMTP(host)
+    autoblockchainify.mail.imap_connection = lambda host, port: FakeIMAP()
+    autoblockchainify.mail.body_signature_correct = fake_signature_correct
+    autoblockchainify.commit.cross_timestamp = fake_cross_timestamp
+    return FakeSMTP.stamper
+
+
+def schedule_workload(clock, repo, start, end, per_day, rng):
+    """Write files at random times (with occasional bursts); returns the
+    list of `(virtual time, path)`, filled in as the files are written"""
+    written = []
+    count = int((end - start) / 86400 * per_day)
+    for n in range(count):
+        when = rng.uniform(start, end)
+        burst = 1 if rng.random() > 0.1 else rng.randint(2, 20)
+        for b in range(burst):
+            path = 'data/%05d-%02d' % (n, b)
+
+            def write(path=path, when=when + b):
+                Path(repo, 'data').mkdir(exist_ok=True)
+                Path(repo, path).write_text('%s %f\n' % (path, when))
+                written.append((clock.time(), path))
+            clock.at(when + b, write)
+    return written
+
+
+def git(repo, *args):
+    return subprocess.run(['git'] + list(args), cwd=repo,
+                          capture_output=True, text=True, check=True).stdout
+
+
+def check(repo, arg, written, requests, start, end):
+    """Check the history from `start` to `end` against the guarantees;
+    returns the violations and a summary"""
+    violations = []
+    interval = arg.commit_interval.total_seconds()
+    force = interval * arg.force_after_intervals
+    commits = [line.split() for line in
+               git(repo, 'log', '--first-parent', '--reverse',
+                   '--format=%H %ct').splitlines()]
+
+    # Every change is committed by the next cycle (with
+    # `--shard-subdirectories`, possibly in a shard's history)
+    added = {}
+    histories = [(repo, '')]
+    histories += [(os.path.join(repo, name), name + '/')
+                  for name in autoblockchainify.shard.committed_shards(repo)]
+    for (path, prefix) in histories:
+        when = None
+        for line in git(path, 'log', '--reverse', '--diff-filter=A',
+                        '--name-only', '--format=@%ct').splitlines():
+            if line.startswith('@'):
+                when = int(line[1:])
+            elif line and added.get(prefix + line, when) >= when:
+                added[prefix + line] = when
+    for (t, path) in written:
+        if path not in added:
+            violations.append("%s written at %s never committed"
+                              % (path, iso(t)))
+        elif added[path] > t + interval + 1:
+            violations.append("%s written at %s only committed at %s"
+                              % (path, iso(t), iso(added[path])))
+
+    # A commit at least every force interval (with 5% tolerance + 1 cycle)
+    for (a, b) in zip(commits, commits[1:]):
+        if int(b[1]) - int(a[1]) > force + interval:
+            violations.append("No commit between %s and %s"
+                              % (iso(int(a[1])), iso(int(b[1]))))
+
+    # Every commit is timestamped by every Zeitgitter server
+    # (`--timestamp-window` may merge timestamps of successive commits)
+    for server in arg.zeitgitter_servers:
+        if '=' in server:
+            branch = server.split('=', 1)[0]
+        else:
+            branch = re.sub(r'^https?://|[.:/].*$', '', server) + '-timestamps'
+        stamped = set()
+        for line in git(repo, 'rev-list', '--parents', branch).splitlines():
+            stamped.update(line.split()[1:])
+        unstamped = [c for (c, t) in commits if c not in stamped]
+        if arg.timestamp_window.total_seconds() == 0 and unstamped:
+            violations.append("%d commit(s) not timestamped by %s"
+                              % (len(unstamped), server))
+        elif commits and commits[-1][0] not in stamped:
+            violations.append("Last commit not timestamped by %s" % server)
+
+    # A mail request at least every force interval, and answers committed
+    signed = [int(t) for t in git(repo, 'log', '--reverse', '--format=%ct',
+                                  '--', 'pgp-timestamp*.sig').splitlines()]
+    if arg.mail_accounts:
+        times = [start] + requests + [end]
+        for (a, b) in zip(times, times[1:]):
+            if b - a > force + interval:
+                violations.append("No mail request between %s and %s"
+                                  % (iso(a), iso(b)))
+        # Answered within the reply timeout; a changed signature alone does
+        # not trigger a commit, so it may wait for the next forced commit
+        wait = (autoblockchainify.mail.REPLY_TIMEOUT.total_seconds()
+                + force + interval)
+        for r in requests:
+            if r + wait < end and not any(r < t <= r + wait for t in signed):
+                violations.append("Signature for mail request at %s"
+                                  " not committed" % iso(r))
+    signatures = len(signed)
+    summary = ("%d commits, %d files written, %d mail requests, "
+               "%d signatures committed" % (len(commits), len(written),
+                                            len(requests), signatures))
+    return (violations, summary)
+
+
+def iso(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="""Simulate days of autoblockchainify operation in
+            seconds, with a virtual clock and local stand-ins for the
+            Zeitgitter servers, the PGP Digital Timestamping Service and
+            push repositories. Further arguments are passed to the
+            daemon.""")
+    parser.add_argument('--days', type=float, default=2,
+                        help="virtual duration")
+    parser.add_argument('--seed', type=int, default=1,
+                        help="seed for the workload and `--commit-offset`")
+    parser.add_argument('--changes-per-day', type=float, default=50,
+                        help="number of (bursts of) file writes per day")
+    parser.add_argument('--start', default='2024-01-01T00:00:00',
+                        help="virtual start time (UTC)")
+    parser.add_argument('--no-mail', action='store_true',
+                        help="do not simulate the PGP Timestamping Service")
+    parser.add_argument('--stamper-failover', action='store_true',
+                        help="""make the SMTP server of the default stamper
+                            account unreachable and add a backup account,
+                            in `--stamper-mode failover`""")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep (and print) the simulation directory")
+    (arg, daemon_args) = parser.parse_known_args(args)
+
+    rng = random.Random(arg.seed)
+    random.seed(arg.seed)  # For `--commit-offset`
+    start = (datetime.fromisoformat(arg.start)
+             .replace(tzinfo=timezone.utc).timestamp())
+    end = start + arg.days * 86400
+    tmp = tempfile.mkdtemp(prefix='autoblockchainify-simulation-')
+    repo = os.path.join(tmp, 'repo')
+    remote = os.path.join(tmp, 'remote.git')
+    subprocess.run(['git', 'init', '--quiet', '--bare', remote], check=True)
+
+    clock = VirtualClock(start)
+    mailbox = []
+    stamper = install(clock, mailbox)
+    params = ['--repository', repo,
+              '--identity', 'Simulation <simulation@localhost>',
+              '--zeitgitter-servers', 'gitta diversity',
+              '--push-repository', remote,
+              '--debug-level', 'WARNING']
+    if not arg.no_mail:
+        params += ['--stamper-own-address', 'simulation@localhost',
+                   '--stamper-smtp-server', 'localhost',
+                   '--stamper-imap-server', 'localhost',
+                   '--stamper-password', 'simulation']
+        if arg.stamper_failover:
+            accounts = os.path.join(tmp, 'accounts.ini')
+            with open(accounts, 'w') as f:
+                f.write("[backup]\n"
+                        "own-address = backup@localhost\n"
+                        "smtp-server = backup.localhost\n"
+                        "imap-server = backup.localhost\n")
+            FakeSMTP.unreachable.add('localhost')
+            params += ['--stamper-accounts', accounts,
+                       '--stamper-mode', 'failover']
+    autoblockchainify.config.get_args(params + daemon_args)
+    config = autoblockchainify.config.arg
+    autoblockchainify.daemon.finish_setup(config)
+    autoblockchainify.repository.open_context(repo)
+
+    written = schedule_workload(clock, repo, start, end,
+                                arg.changes_per_day, rng)
+    clock.at(end, autoblockchainify.commit.shutdown.set)
+    wall = time.monotonic()
+    autoblockchainify.commit.loop()
+    for t in threading.enumerate():
+        if t.name.startswith('commit'):
+            t.join()
+    wall = time.monotonic() - wall
+
+    (violations, summary) = check(repo, config, written, stamper.requests,
+                                  start, end)
+    if arg.stamper_failover and not arg.no_mail:
+        if 'backup.localhost' not in stamper.hosts:
+            violations.append("No mail request through the backup account")
+        if not git(repo, 'log', '-1', '--format=%H', '--',
+                   'pgp-timestamp-backup.sig'):
+            violations.append("No signature of the backup account committed")
+    print("Simulated %s to %s in %.1fs: %s"
+          % (iso(start), iso(end), wall, summary))
+    if clock.stalls:
+        print("Advanced the clock %d times while threads were busy"
+              % clock.stalls)
+    for v in violations:
+        print("VIOLATION: " + v)
+    if arg.keep:
+        print("Simulation directory: " + tmp)
+    else:
+        shutil.rmtree(tmp)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
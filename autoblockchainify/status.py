@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# HTTP status endpoint (`--status-listen`)
+#
+# * `GET /healthz`: `200 OK` if the scheduler is alive, no commit cycle is
+#   stuck and the last commit is recent enough; `503` with the reasons
+#   otherwise.
+# * `GET /status`: JSON with the last commit, the age of the last timestamp
+#   per Zeitgitter server, the push state per repository (URL without
+#   credentials), the mail requests per stamper account and the scheduler
+#   state, plus all metrics.
+# Both are answered from the in-memory metrics only, without accessing the
+# repository. `python3 -m autoblockchainify.status` queries the endpoint,
+# e.g. from `health.sh`.
+
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+
+import autoblockchainify.clock
+import autoblockchainify.config
+import autoblockchainify.log
+import autoblockchainify.metrics
+
+logging = autoblockchainify.log.Logger("status")
+
+
+def iso(t):
+    if t is None:
+        return None
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+def age(now, t):
+    return None if t is None else round(now - t, 3)
+
+
+def per_target(metrics, kind):
+    """{target: {field: value}} from metrics named `kind.<target>.<field>`"""
+    result = {}
+    for (name, value) in metrics.items():
+        if name.startswith(kind + '.'):
+            (target, field) = name[len(kind) + 1:].rsplit('.', 1)
+            result.setdefault(target, {})[field] = value
+    return result
+
+
+def status():
+    """The state of the daemon, as a JSON-compatible dict"""
+    now = autoblockchainify.clock.time()
+    m = autoblockchainify.metrics.snapshot()
+    if m.get('scheduler.cycle_running'):
+        state = 'committing'
+    elif m.get('scheduler.stopping'):
+        state = 'stopped'
+    else:
+        state = 'waiting'
+    result = {
+        'time': iso(now),
+        'scheduler': {
+            'state': state,
+            'next_cycle': iso(m.get('scheduler.next_cycle')),
+            'cycle_started': iso(m.get('scheduler.cycle_start')),
+            'cycle_age': (age(now, m.get('scheduler.cycle_start'))
+                          if state == 'committing' else None),
+        },
+        'last_commit': {
+            'id': m.get('commit.last_id'),
+            'time': iso(m.get('commit.last_time')),
+            'age': age(now, m.get('commit.last_time')),
+        },
+        'timestamps': {},
+        'push': {},
+        'mail': {},
+        'metrics': m,
+    }
+    for (server, t) in per_target(m, 'timestamp').items():
+        result['timestamps'][server] = {
+            'time': iso(t.get('last_time')),
+            'age': age(now, t.get('last_time')),
+            'failed': t.get('failed', False),
+        }
+    for (remote, p) in per_target(m, 'push').items():
+        result['push'][remote] = {
+            'time': iso(p.get('last_time')),
+            'age': age(now, p.get('last_time')),
+            'up_to_date': p.get('last_id') == m.get('commit.last_id'),
+            'failed': p.get('failed', False),
+        }
+    for (account, a) in per_target(m, 'mail').items():
+        pending = a.get('pending', False)
+        result['mail'][account] = {
+            'pending': pending,
+            'requested': iso(a.get('requested_time')),
+            'pending_age': (age(now, a.get('requested_time'))
+                            if pending else None),
+            'received': iso(a.get('received_time')),
+            'failed': a.get('failed', False),
+        }
+    return result
+
+
+def problems():
+    """Reasons why the daemon is unhealthy (empty if healthy)"""
+    arg = autoblockchainify.config.arg
+    interval = arg.commit_interval.total_seconds()
+    force = interval * arg.force_after_intervals
+    now = autoblockchainify.clock.time()
+    m = autoblockchainify.metrics.snapshot()
+    reasons = []
+    next_cycle = m.get('scheduler.next_cycle')
+    if m.get('scheduler.stopping'):
+        reasons.append("shutting down")
+    elif next_cycle is None or now > next_cycle + interval:
+        reasons.append("scheduler not running")
+    if (m.get('scheduler.cycle_running')
+            and now > m.get('scheduler.cycle_start', now) + force):
+        reasons.append("commit cycle running for %ds"
+                       % (now - m['scheduler.cycle_start']))
+    last = m.get('commit.last_time')
+    if last is not None and now > last + force + 2 * interval:
+        reasons.append("no commit for %ds" % (now - last))
+    return reasons
+
+
+def handler_class():
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, code, body, content_type):
+            data = body.encode('UTF-8')
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/healthz':
+                reasons = problems()
+                if reasons:
+                    self.reply(503, '\n'.join(reasons) + '\n', 'text/plain')
+                else:
+                    self.reply(200, 'OK\n', 'text/plain')
+            elif self.path == '/status':
+                self.reply(200, json.dumps(status(), indent=2) + '\n',
+                           'application/json')
+            else:
+                self.reply(404, 'Not found\n', 'text/plain')
+
+        do_HEAD = do_GET
+
+        def log_message(self, format, *args):
+            # `client_address` is empty for Unix domain sockets
+            logging.xdebug("%s", format % args)
+
+    return Handler
+
+
+def serve(listen):
+    """Start answering requests on `listen` (`host:port` or
+    `unix:<path>`) in a daemon thread"""
+    # Only needed with `--status-listen`, speeds up startup
+    import socketserver
+    from http.server import ThreadingHTTPServer
+    if listen.startswith('unix:'):
+        path = listen[5:]
+        if os.path.exists(path):
+            os.unlink(path)  # Left over from previous run
+
+        class Server(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+            daemon_threads = True
+        server = Server(path, handler_class())
+    else:
+        (host, port) = listen.rsplit(':', 1)
+        server = ThreadingHTTPServer((host.strip('[]'), int(port)),
+                                     handler_class())
+        server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="status",
+                     daemon=True).start()
+    logging.info("Serving status on %s", listen)
+    return server
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="""Query the status endpoint of a running
+            autoblockchainify; exits with 0 if the request succeeded (for
+            `/healthz`: if the daemon is healthy).""")
+    parser.add_argument('--status-listen',
+                        default=os.getenv('AUTOBLOCKCHAINIFY_STATUS_LISTEN'),
+                        help="""address of the endpoint, as for the daemon
+                            (default: $AUTOBLOCKCHAINIFY_STATUS_LISTEN)""")
+    parser.add_argument('--timeout', type=float, default=3,
+                        help="seconds to wait for the answer")
+    parser.add_argument('path', nargs='?', default='/healthz',
+                        help="`/healthz` (default) or `/status`")
+    arg = parser.parse_args(args)
+    if not arg.status_listen:
+        parser.error("--status-listen required")
+
+    import http.client
+    import socket
+    if arg.status_listen.startswith('unix:'):
+        class Connection(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
+                self.sock.connect(arg.status_listen[5:])
+        conn = Connection('localhost', timeout=arg.timeout)
+    else:
+        (host, port) = arg.status_listen.rsplit(':', 1)
+        if host in ('', '0.0.0.0', '[::]'):
+            host = 'localhost'
+        conn = http.client.HTTPConnection(
+            host.strip('[]'), int(port), timeout=arg.timeout)
+    try:
+        conn.request('GET', arg.path)
+        response = conn.getresponse()
+        sys.stdout.write(response.read().decode('UTF-8'))
+        return 0 if response.status == 200 else 1
+    except OSError as e:
+        print("Cannot query %s: %s" % (arg.status_listen, e), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+#
+# autoblockchainify — Turn a directory into a GIT Blockchain
+#
+# Copyright (C) 2019-2021 Marcel Waldvogel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Limiting the resources used for scanning and committing
+#
+# * `git status`, `git add` and `git commit` run with `--nice` and
+#   `--ionice-class`, through the `nice` and `ionice` commands (the daemon
+#   is multi-threaded, so they cannot be applied between fork and exec).
+# * With `--max-scan-rate` (files/s) or `--max-read-rate` (bytes/s), the
+#   changed files are added in batches, pausing between them. The pauses
+#   never stretch the work beyond half of `--commit-interval`; the budget
+#   is exceeded instead (and a warning logged).
+# * `--cgroup` moves the whole daemon into an existing cgroup (v2).
+
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+import autoblockchainify.config
+import autoblockchainify.log
+import autoblockchainify.metrics
+
+logging = autoblockchainify.log.Logger("commit")
+
+IONICE_CLASSES = {'': None, 'idle': '3', 'best-effort': '2'}
+BATCH_FILES = 1000  # Maximum number of paths per `git add`
+
+
+def join_cgroup():
+    """Move this process (and, thus, all its future children) into
+    `--cgroup`, if given. To be called at startup."""
+    cgroup = autoblockchainify.config.arg.cgroup
+    if cgroup:
+        try:
+            with Path(cgroup, 'cgroup.procs').open('w') as f:
+                f.write(str(os.getpid()))
+            logging.info("Joined cgroup %s", cgroup)
+        except OSError as e:
+            logging.error("Cannot join cgroup %s: %s", cgroup, e)
+
+
+def command(cmd):
+    """`cmd` prefixed as needed for `--nice` and `--ionice-class`"""
+    cls = IONICE_CLASSES[autoblockchainify.config.arg.ionice_class]
+    if cls is not None:
+        if shutil.which('ionice') is None:
+            logging.warning("`ionice` not found, ignoring --ionice-class")
+        else:
+            cmd = ['ionice', '-c', cls] + cmd
+    nice = autoblockchainify.config.arg.nice
+    if nice > 0:
+        if shutil.which('nice') is None:
+            logging.warning("`nice` not found, ignoring --nice")
+        else:
+            cmd = ['nice', '-n', str(nice)] + cmd
+    return cmd
+
+
+def run(cmd, **kwargs):
+    """`subprocess.run()` with the resource limits applied"""
+    return subprocess.run(command(cmd), **kwargs)
+
+
+def limited():
+    """Whether the work needs to be paced"""
+    return (autoblockchainify.config.arg.max_scan_rate is not None
+            or autoblockchainify.config.arg.max_read_rate is not None)
+
+
+class Budget:
+    """Paces processing `files` files with `size` bytes in total, according
+    to `--max-scan-rate` and `--max-read-rate`, but finishing within half
+    of `--commit-interval`. `interrupt` (an `Event`) ends all pauses."""
+
+    def __init__(self, files, size, interrupt):
+        arg = autoblockchainify.config.arg
+        self.interrupt = interrupt
+        self.start = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.paused = 0
+        duration = 0
+        if arg.max_scan_rate is not None:
+            duration = max(duration, files / arg.max_scan_rate)
+        if arg.max_read_rate is not None:
+            duration = max(duration, size / arg.max_read_rate)
+        limit = arg.commit_interval.total_seconds() / 2
+        # Seconds per file and per byte
+        self.file_cost = (1 / arg.max_scan_rate
+                          if arg.max_scan_rate is not None else 0)
+        self.byte_cost = (1 / arg.max_read_rate
+                          if arg.max_read_rate is not None else 0)
+        if duration > limit:
+            logging.warning("Resource budget would need %ds for %d files "
+                            "(%d bytes), spreading over %ds instead",
+                            duration, files, size, limit)
+            self.file_cost *= limit / duration
+            self.byte_cost *= limit / duration
+
+    def spend(self, files, size):
+        """Account for work done; pause until it is within budget"""
+        self.files += files
+        self.bytes += size
+        due = self.start + max(self.files * self.file_cost,
+                               self.bytes * self.byte_cost)
+        delay = due - time.monotonic()
+        if delay > 0:
+            self.paused += delay
+            self.interrupt.wait(delay)
+
+    def report(self, stage):
+        """Record the throughput achieved in the metrics"""
+        arg = autoblockchainify.config.arg
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        autoblockchainify.metrics.update({
+            stage + '.files': self.files,
+            stage + '.bytes': self.bytes,
+            stage + '.seconds': elapsed,
+            stage + '.paused_seconds': self.paused,
+            stage + '.files_per_second': self.files / elapsed,
+            stage + '.bytes_per_second': self.bytes / elapsed,
+            stage + '.max_files_per_second': arg.max_scan_rate,
+            stage + '.max_bytes_per_second': arg.max_read_rate,
+        })
+        logging.debug("%s: %d files, %d bytes in %.1fs (%.1f files/s, "
+                      "%.0f bytes/s; budget %s files/s, %s bytes/s)",
+                      stage, self.files, self.bytes, elapsed,
+                      self.files / elapsed, self.bytes / elapsed,
+                      arg.max_scan_rate, arg.max_read_rate)
@@ -56,6 +56,8 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'autoblockchainify=autoblockchainify.daemon:run',
+            'autoblockchainify-lookup=autoblockchainify.index:main',
+            'autoblockchainify-proof=autoblockchainify.proof:main',
         ],
     },
     classifiers=[
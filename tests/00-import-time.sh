@@ -0,0 +1,51 @@
+#!/bin/sh
+# Startup (importing the daemon, parsing the configuration and setting up,
+# up to the commit loop) must not load the modules only needed for
+# committing or mailing; also report the time it takes.
+# Run from the top-level directory (as `make system-tests` does).
+limit=${IMPORT_TIME_LIMIT_MS:-500}
+tmp=`mktemp -d`
+git init --quiet "$tmp"
+out=`python3 - "$tmp" 2>&1 <<'PYTHON'
+import sys
+import time
+
+start = time.monotonic()
+import autoblockchainify.commit
+import autoblockchainify.daemon
+
+
+def loop():
+    ms = int((time.monotonic() - start) * 1000)
+    loaded = [m for m in ('pygit2', 'smtplib', 'imaplib', 'sqlite3')
+              if m in sys.modules]
+    if loaded:
+        sys.exit("%s loaded at startup" % ', '.join(loaded))
+    print("%d" % ms)
+
+
+autoblockchainify.commit.loop = loop
+sys.argv = ['autoblockchainify', '--repository', sys.argv[1],
+            '--zeitgitter-servers', 'gitta',
+            '--stamper-own-address', 'startup@localhost',
+            '--stamper-smtp-server', 'localhost',
+            '--stamper-imap-server', 'localhost',
+            '--stamper-password', 'startup',
+            '--debug-level', 'ERROR']
+autoblockchainify.daemon.run()
+PYTHON
+`
+ret=$?
+rm -rf "$tmp"
+if [ $ret != 0 ]; then
+  echo "$out" | tail -3
+  echo "$0: Startup failed"
+  exit 1
+fi
+ms=`echo "$out" | tail -1`
+echo "$0: Starting the daemon takes ${ms}ms"
+if [ $ms -gt $limit ]; then
+  echo "$0: Startup slower than ${limit}ms"
+  exit 1
+fi
+exit 0
@@ -0,0 +1,17 @@
+#!/bin/sh
+# Simulate a few days of operation (virtual clock, local stand-ins for the
+# timestamping services) and check the scheduling guarantees; then again
+# with an unreachable primary mail account, which has to fail over (and the
+# backup account has to deliver the signatures), and with the top-level
+# directories committed as shards.
+# Run from the top-level directory (as `make system-tests` does).
+for options in "" "--stamper-failover" "--shard-subdirectories"; do
+  out=`python3 -m autoblockchainify.simulation --days ${SIMULATION_DAYS:-3} $options 2>&1`
+  ret=$?
+  echo "$out" | grep -E '^(Simulated|VIOLATION|Advanced)'
+  if [ $ret != 0 ]; then
+    echo "$0: Simulation ${options:-without options} failed"
+    exit 1
+  fi
+done
+exit 0
@@ -0,0 +1,65 @@
+#!/bin/sh
+# Commit cycles go on after a failing stage (here: `git timestamp` missing)
+# and after an interrupted cycle has been resumed from the journal.
+# Run from the top-level directory (as `make system-tests` does).
+tmp=`mktemp -d`
+out=`python3 - "$tmp" 2>&1 <<'PYTHON'
+import subprocess
+import sys
+
+import autoblockchainify.commit
+import autoblockchainify.config
+import autoblockchainify.daemon
+import autoblockchainify.journal
+import autoblockchainify.repository
+
+repo = sys.argv[1]
+autoblockchainify.config.get_args(['--repository', repo,
+                                   '--zeitgitter-servers', 'gitta',
+                                   '--debug-level', 'ERROR'])
+autoblockchainify.daemon.finish_setup(autoblockchainify.config.arg)
+context = autoblockchainify.repository.open_context(repo)
+
+
+def missing_git_timestamp(repo, options, server):
+    raise FileNotFoundError("git-timestamp")
+
+
+def check(name, commits):
+    status = subprocess.run(['git', 'status', '--porcelain'], cwd=repo,
+                            capture_output=True, text=True).stdout
+    count = subprocess.run(['git', 'rev-list', '--count', 'HEAD'], cwd=repo,
+                           capture_output=True, text=True).stdout.strip()
+    if status != '' or count != str(commits):
+        sys.exit("%s: %s commits, uncommitted: %r" % (name, count, status))
+
+
+autoblockchainify.commit.cross_timestamp = missing_git_timestamp
+for i in range(3):
+    with open('%s/f%d' % (repo, i), 'w') as f:
+        f.write('%d\n' % i)
+    autoblockchainify.commit.do_commit()
+    check("Failing stage, cycle %d" % i, i + 1)
+
+# Interrupted right after the journal has been written
+with open(repo + '/f3', 'w') as f:
+    f.write('3\n')
+autoblockchainify.journal.Journal(repo).begin(
+    context.head_hex(), autoblockchainify.commit.cycle_stages())
+autoblockchainify.commit.do_commit()
+check("Resumed cycle", 4)
+with open(repo + '/f4', 'w') as f:
+    f.write('4\n')
+autoblockchainify.commit.do_commit()
+check("Cycle after resumption", 5)
+PYTHON
+`
+ret=$?
+rm -rf "$tmp"
+if [ $ret != 0 ]; then
+  echo "$out" | tail -3
+  echo "$0: Commit cycles stopped"
+  exit 1
+fi
+echo "$0: Commit cycles continue after failures and interruptions"
+exit 0
@@ -0,0 +1,42 @@
+#!/bin/sh
+# A reload (SIGHUP) with an invalid configuration keeps the previous one;
+# a valid one replaces it.
+# Run from the top-level directory (as `make system-tests` does).
+tmp=`mktemp -d`
+out=`python3 - "$tmp" 2>&1 <<'PYTHON'
+import datetime
+import sys
+
+import autoblockchainify.config
+
+repo = sys.argv[1]
+base = ['--repository', repo, '--commit-interval', '10m']
+autoblockchainify.config.get_args(base)
+previous = autoblockchainify.config.arg
+for invalid in (['--timestamp-window', 'bogus'], ['--commit-interval', '5q'],
+                ['--seal-after', 'x'], ['--force-after-intervals', '1'],
+                ['--no-such-option']):
+    autoblockchainify.config.parse_params = (base + invalid, None)
+    if autoblockchainify.config.reload():
+        sys.exit("Reload with %s accepted" % invalid)
+    if autoblockchainify.config.arg is not previous:
+        sys.exit("Reload with %s changed the configuration" % invalid)
+
+autoblockchainify.config.parse_params = (
+    ['--repository', repo, '--commit-interval', '20m'], None)
+if not autoblockchainify.config.reload():
+    sys.exit("Valid reload rejected")
+if (autoblockchainify.config.arg.commit_interval
+        != datetime.timedelta(minutes=20)):
+    sys.exit("Valid reload not applied")
+PYTHON
+`
+ret=$?
+rm -rf "$tmp"
+if [ $ret != 0 ]; then
+  echo "$out" | tail -3
+  echo "$0: Reload failed"
+  exit 1
+fi
+echo "$0: Invalid configurations rejected on reload"
+exit 0
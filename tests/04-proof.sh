@@ -0,0 +1,84 @@
+#!/bin/sh
+# An exported evidence bundle verifies and contains the file version current
+# at the requested time, with its timestamps; no bundle for a deleted file.
+# Run from the top-level directory (as `make system-tests` does).
+tmp=`mktemp -d`
+out=`python3 - "$tmp" 2>&1 <<'PYTHON'
+import base64
+import os
+import subprocess
+import sys
+
+import autoblockchainify.index
+import autoblockchainify.proof
+import autoblockchainify.simulation
+
+repo = sys.argv[1]
+os.environ.update(GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@example.org',
+                  GIT_COMMITTER_NAME='Test',
+                  GIT_COMMITTER_EMAIL='test@example.org')
+
+
+def git(*args, when=None):
+    env = dict(os.environ)
+    if when is not None:
+        env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = '%d +0000' % when
+    return subprocess.run(['git'] + list(args), cwd=repo, env=env,
+                          capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def commit(files, when):
+    for (path, contents) in files.items():
+        if contents is None:
+            os.unlink(os.path.join(repo, path))
+        else:
+            os.makedirs(os.path.dirname(os.path.join(repo, path)),
+                        exist_ok=True)
+            with open(os.path.join(repo, path), 'w') as f:
+                f.write(contents)
+    git('add', '-A')
+    git('commit', '-q', '-m', 'Test', when=when)
+    return git('rev-parse', 'HEAD')
+
+
+def check(name, when, commit, contents, pgp):
+    bundle = autoblockchainify.proof.export(repo, 'a/b/f', when)
+    findings = autoblockchainify.proof.verify(bundle, check_signatures=False)
+    data = base64.b64decode(bundle['objects'][bundle['blob']]['data'])
+    if (bundle['commit'] != commit or data != contents.encode()
+            or len(bundle['timestamps']) != 1 or len(bundle['pgp']) != pgp
+            or len(findings) != 2 + pgp):
+        sys.exit("%s: %r" % (name, findings))
+
+
+git('init', '-q')
+c1 = commit({'a/b/f': 'v1\n', 'g': 'g\n'}, 160000000)
+autoblockchainify.simulation.fake_cross_timestamp(repo, [], 'gitta')
+commit({'pgp-timestamp.sig': 'git commit %s\n' % c1}, 160001000)
+commit({'g': 'g2\n'}, 160002000)
+c2 = commit({'a/b/f': 'v2\n'}, 160003000)
+autoblockchainify.simulation.fake_cross_timestamp(repo, [], 'gitta')
+commit({'a/b/f': None}, 160004000)
+
+autoblockchainify.index.update(repo)
+check("Indexed, first version", 160002500, c1, 'v1\n', 1)
+check("Indexed, second version", 160003500, c2, 'v2\n', 0)
+try:
+    autoblockchainify.proof.export(repo, 'a/b/f', 160004500)
+    sys.exit("Bundle for a deleted file")
+except KeyError:
+    pass
+os.unlink(autoblockchainify.index.index_path(repo))
+check("Not indexed, first version", 160002500, c1, 'v1\n', 0)
+PYTHON
+`
+ret=$?
+rm -rf "$tmp"
+if [ $ret != 0 ]; then
+  echo "$out" | tail -3
+  echo "$0: Evidence bundle export/verify failed"
+  exit 1
+fi
+echo "$0: Evidence bundles verify and match the file version at that time"
+exit 0